@@ -0,0 +1,309 @@
+import argparse
+import glob
+import hashlib
+import inspect
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Incremental builder for the weather_events feature table produced in
+# ml_projectTOTO.ipynb (county names, tornado labels, wind shear). The table
+# is stored as one parquet file per day. Each day is keyed by the content
+# hash of its raw weather rows, the tornado events whose labeling window
+# touches it, and the feature code, and only days whose key changed are
+# rebuilt. Raw files are hashed before parsing, so unchanged history is never
+# re-read, and a file that only had rows appended, like the single
+# historical_weather_IA.csv growing by a day, has just the appended bytes
+# parsed as a new segment of it; every output and the manifest are written
+# atomically.
+
+script_dir = os.path.dirname(__file__)
+# Neighbor features come from the client's spatial module, so training and
+# serving share one definition
+sys.path.append(os.path.join(script_dir, '..', 'RTS'))
+import spatial
+from spatial import NEIGHBOR_FEATURES, CountyGraph
+from synthetic_stream import calculate_wind_shear
+
+RAW_WEATHER = os.path.join(script_dir, 'historical_weather_IA.csv')
+EVENTS_FILE = os.path.join(script_dir, 'TornadoEvents.csv')
+COUNTIES_FILE = os.path.join(script_dir, 'Iowa_Counties_Centroid.csv')
+OUTPUT_DIR = os.path.join(script_dir, 'feature_table')
+# County adjacency written by RTS/spatial.py
+ADJACENCY_FILE = spatial.ADJACENCY_FILE
+MANIFEST_NAME = 'manifest.json'
+
+# Bump to force a full rebuild when the meaning of a feature changes
+FEATURE_CODE_VERSION = 1
+
+# Labeling window around each tornado's BEGIN_DATETIME, as in the notebook
+LABEL_BEFORE = pd.Timedelta(hours=3)
+LABEL_AFTER = pd.Timedelta(hours=1)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Hashes of a file's first prefix bytes and of the whole file, in one read
+def prefix_hashes(path, prefix):
+    digest = hashlib.sha256()
+    prefix_digest = None
+    position = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            if prefix_digest is None and position + len(block) >= prefix:
+                digest.update(block[:prefix - position])
+                prefix_digest = digest.hexdigest()
+                digest.update(block[prefix - position:])
+            else:
+                digest.update(block)
+            position += len(block)
+    if prefix_digest is None and position == prefix:
+        prefix_digest = digest.hexdigest()
+    return prefix_digest, digest.hexdigest()
+
+
+def frame_hash(df):
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+
+# Neighbor mean/max of each field at the same hour, for all hours of the day
+# at once, with the same CountyGraph aggregation the client runs per tick
+def add_neighbor_features(df, graph):
+    position = df['county_name'].map(graph.index)
+    known = position.notna().to_numpy()
+    rows = position[known].astype(int).to_numpy()
+    times, columns = np.unique(df.loc[known, 'time'].to_numpy(), return_inverse=True)
+    values = np.full((len(graph), len(times), len(NEIGHBOR_FEATURES)), np.nan)
+    values[rows, columns] = df.loc[known, NEIGHBOR_FEATURES].to_numpy(dtype=np.float64)
+    for name, result in graph.neighbor_features(values, NEIGHBOR_FEATURES).items():
+        column = np.full(len(df), np.nan)
+        column[known] = result[rows, columns]
+        df[name] = column
+    return df
+
+
+def load_events(events_file):
+    events = pd.read_csv(events_file, usecols=['CZ_NAME_STR', 'BEGIN_DATE', 'BEGIN_TIME'])
+    events['county_name'] = events['CZ_NAME_STR'].str.title().str.replace(' Co.', '', regex=False)
+    begin_time = events['BEGIN_TIME'].astype(str).str.zfill(4)
+    events['begin'] = pd.to_datetime(events['BEGIN_DATE'] + ' ' + begin_time.str[:2] + ':' + begin_time.str[2:])
+    events['window_start'] = events['begin'] - LABEL_BEFORE
+    events['window_end'] = events['begin'] + LABEL_AFTER
+    return events[['county_name', 'begin', 'window_start', 'window_end']]
+
+
+# Events per day for every day a labeling window touches
+def events_by_day(events):
+    days = {}
+    for event in events.itertuples(index=False):
+        for day in pd.date_range(event.window_start.normalize(), event.window_end.normalize(), freq='D'):
+            days.setdefault(day.strftime('%Y-%m-%d'), []).append((event.county_name, event.begin.isoformat()))
+    return {day: sorted(items) for day, items in days.items()}
+
+
+# Build one day of the feature table from its raw weather rows and events
+def compute_features(raw, county_names, day_events, graph=None):
+    df = raw.copy()
+    df['county_name'] = county_names[df['location_id'].to_numpy()]
+    df['time'] = pd.to_datetime(df['time'])
+
+    df['tornado'] = 0
+    for county, begin in day_events:
+        begin = pd.Timestamp(begin)
+        mask = ((df['county_name'] == county) &
+                (df['time'] >= begin - LABEL_BEFORE) & (df['time'] <= begin + LABEL_AFTER))
+        df.loc[mask, 'tornado'] = 1
+
+    df['wind_shear'] = calculate_wind_shear(df['wind_speed_10m'], df['wind_speed_100m'],
+                                            df['wind_direction_10m'], df['wind_direction_100m']).round(2)
+    if graph is not None:
+        df = add_neighbor_features(df, graph)
+    return df.sort_values(['time', 'location_id']).reset_index(drop=True)
+
+
+def code_hash(counties_file, adjacency_file=None):
+    digest = hashlib.sha256()
+    digest.update(str(FEATURE_CODE_VERSION).encode('utf-8'))
+    for func in (compute_features, calculate_wind_shear):
+        digest.update(inspect.getsource(func).encode('utf-8'))
+    digest.update(repr((LABEL_BEFORE, LABEL_AFTER)).encode('utf-8'))
+    digest.update(file_hash(counties_file).encode('utf-8'))
+    if adjacency_file:
+        digest.update(inspect.getsource(add_neighbor_features).encode('utf-8'))
+        digest.update(inspect.getsource(CountyGraph).encode('utf-8'))
+        digest.update(repr(NEIGHBOR_FEATURES).encode('utf-8'))
+        digest.update(file_hash(adjacency_file).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def list_raw_files(raw):
+    if os.path.isdir(raw):
+        return sorted(glob.glob(os.path.join(raw, '*.csv')))
+    return [raw]
+
+
+# Rows of a raw file, or of the byte range [start, end) of it, which starts
+# on a line boundary and is read under the file's header line
+def read_raw(path, start=0, end=None):
+    if start == 0 and end is None:
+        df = pd.read_csv(path, encoding='utf-8-sig')
+    else:
+        with open(path, 'rb') as f:
+            header = f.readline() if start else b''
+            f.seek(start)
+            data = f.read(end - start)
+        df = pd.read_csv(io.BytesIO(header + data), encoding='utf-8-sig')
+    df['day'] = df['time'].str[:10]
+    return df
+
+
+def day_hashes(df):
+    return {day: frame_hash(rows.drop(columns='day')) for day, rows in df.groupby('day')}
+
+
+# Rows appended after a complete last line leave the old rows intact
+def ends_line(path, size):
+    with open(path, 'rb') as f:
+        f.seek(size - 1)
+        return f.read(1) == b'\n'
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'files': {}, 'days': {}}
+
+
+def write_atomic_parquet(df, path):
+    tmp_path = f'{path}.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def write_manifest(manifest, output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def build(raw=RAW_WEATHER, events_file=EVENTS_FILE, counties_file=COUNTIES_FILE, output_dir=OUTPUT_DIR,
+          adjacency_file=None):
+    os.makedirs(output_dir, exist_ok=True)
+    previous = load_manifest(output_dir)
+    county_names = pd.read_csv(counties_file)['CountyName'].to_numpy()
+    code = code_hash(counties_file, adjacency_file)
+    graph = CountyGraph.load(adjacency_file) if adjacency_file else None
+    day_events = events_by_day(load_events(events_file))
+
+    # Hash raw files first; only new or changed files, or the appended tail
+    # of a file that grew, are parsed. parsed is keyed by (file, segment start)
+    parsed = {}
+    files = {}
+    for path in list_raw_files(raw):
+        name = os.path.relpath(path, raw) if os.path.isdir(raw) else os.path.basename(path)
+        size = os.path.getsize(path)
+        old = previous['files'].get(name)
+        if old is not None and 'segments' not in old:
+            old = None
+        grew = old is not None and 0 < old['size'] < size and ends_line(path, old['size'])
+        if grew:
+            prefix_digest, digest = prefix_hashes(path, old['size'])
+            grew = prefix_digest == old['hash']
+        else:
+            digest = file_hash(path)
+        if old is not None and old['hash'] == digest:
+            files[name] = dict(old, path=os.path.abspath(path))
+            continue
+        if grew:
+            df = read_raw(path, old['size'], size)
+            segments = old['segments'] + [{'start': old['size'], 'days': day_hashes(df)}]
+            parsed[(name, old['size'])] = df
+        else:
+            df = read_raw(path)
+            segments = [{'start': 0, 'days': day_hashes(df)}]
+            parsed[(name, 0)] = df
+        files[name] = {'path': os.path.abspath(path), 'hash': digest, 'size': size, 'segments': segments}
+
+    # Partition key per day: raw rows (across files and segments), events,
+    # code version
+    raw_days = {}
+    for name, entry in sorted(files.items()):
+        for segment in entry['segments']:
+            for day, digest in segment['days'].items():
+                raw_days.setdefault(day, []).append(f"{name}@{segment['start']}:{digest}")
+    days = {}
+    for day, raw_parts in raw_days.items():
+        labels = hashlib.sha256(json.dumps(day_events.get(day, [])).encode('utf-8')).hexdigest()
+        raw_digest = hashlib.sha256('|'.join(raw_parts).encode('utf-8')).hexdigest()
+        days[day] = {'raw': raw_digest, 'labels': labels, 'code': code}
+
+    stale = [day for day, key in days.items()
+             if previous['days'].get(day) != key or not os.path.exists(os.path.join(output_dir, f'{day}.parquet'))]
+    removed = [day for day in previous['days'] if day not in days]
+
+    # Rebuilding a day needs every raw segment that contributes to it
+    stale_set = set(stale)
+    for name, entry in files.items():
+        ends = [segment['start'] for segment in entry['segments'][1:]] + [entry['size']]
+        for segment, end in zip(entry['segments'], ends):
+            key = (name, segment['start'])
+            if key not in parsed and stale_set.intersection(segment['days']):
+                parsed[key] = read_raw(entry['path'], segment['start'], end)
+
+    rows_by_day = {}
+    for key, df in parsed.items():
+        for day, rows in df[df['day'].isin(stale_set)].groupby('day'):
+            rows_by_day.setdefault(day, []).append(rows.drop(columns='day'))
+    for day in sorted(stale):
+        raw_rows = pd.concat(rows_by_day[day], ignore_index=True)
+        features = compute_features(raw_rows, county_names, day_events.get(day, []), graph)
+        write_atomic_parquet(features, os.path.join(output_dir, f'{day}.parquet'))
+    for day in removed:
+        path = os.path.join(output_dir, f'{day}.parquet')
+        if os.path.exists(path):
+            os.remove(path)
+
+    write_manifest({'files': files, 'days': days}, output_dir)
+    return sorted(stale), removed
+
+
+# Single-file table for consumers that expect weather_events.parquet
+def consolidate(output_dir, output_file):
+    paths = sorted(glob.glob(os.path.join(output_dir, '*.parquet')))
+    df = pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+    write_atomic_parquet(df, output_file)
+    return len(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Incrementally build the weather_events feature table')
+    parser.add_argument('--raw', default=RAW_WEATHER, help='raw weather CSV file or directory of CSV files')
+    parser.add_argument('--events', default=EVENTS_FILE)
+    parser.add_argument('--counties', default=COUNTIES_FILE)
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--consolidate', help='also write the whole table to this parquet file')
+    parser.add_argument('--neighbor-features', nargs='?', const=ADJACENCY_FILE, metavar='ADJACENCY',
+                        help='add neighbor mean/max features using this county adjacency file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rebuilt, removed = build(args.raw, args.events, args.counties, args.output_dir, args.neighbor_features)
+    print(f"Rebuilt {len(rebuilt)} day partitions, removed {len(removed)} in {time.perf_counter() - start:.2f}s")
+    if args.consolidate:
+        rows = consolidate(args.output_dir, args.consolidate)
+        print(f"Wrote {rows} rows to {args.consolidate}")
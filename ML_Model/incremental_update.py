@@ -0,0 +1,242 @@
+import argparse
+import glob
+import json
+import os
+import pickle
+import tempfile
+import time
+
+import pandas as pd
+from sklearn.metrics import log_loss
+from sklearn.model_selection import train_test_split
+
+import feature_table
+import train_pipeline
+import tree_model
+from train_pipeline import ARTIFACTS_DIR, ID_COLUMNS, RANDOM_STATE
+
+# Incremental retraining of the live XGBoost model. Boosting rounds are
+# appended to the current booster using only feature-table days it has not
+# seen yet (training continuation), and the result is promoted only if it
+# does no worse than the current model on a holdout of the new days and,
+# optionally, on a fixed reference holdout that guards against drift. Every
+# few updates a full rebuild through train_pipeline runs instead.
+
+script_dir = os.path.dirname(__file__)
+LIVE_MODEL = os.path.join(script_dir, '..', 'RTS', 'xgb_model.pkl')
+STATE_FILE = os.path.join(ARTIFACTS_DIR, 'incremental_state.json')
+
+NEW_ROUNDS = 20
+HOLDOUT_FRACTION = 0.2
+# Allowed relative log loss increase before an update is rejected
+TOLERANCE = 0.01
+FULL_REBUILD_EVERY = 8
+
+
+def load_state(state_file):
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'trained_through': None, 'updates_since_full': 0, 'history': []}
+
+
+def save_state(state, state_file):
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    tmp_path = f'{state_file}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_file)
+
+
+def new_partitions(table_dir, trained_through):
+    paths = sorted(glob.glob(os.path.join(table_dir, '*.parquet')))
+    days = [(os.path.basename(path)[:-len('.parquet')], path) for path in paths]
+    return [(day, path) for day, path in days if trained_through is None or day > trained_through]
+
+
+def split_features(df):
+    return df.drop(columns=ID_COLUMNS), df['tornado']
+
+
+def holdout_loss(model, X, y):
+    return float(log_loss(y, model.predict_proba(X)[:, 1], labels=[0, 1]))
+
+
+# Train and holdout rows of the new days, split the same way on every run
+def split_new_days(partitions):
+    new_data = pd.concat([pd.read_parquet(path) for _, path in partitions], ignore_index=True)
+    y = new_data['tornado']
+    stratify = y if y.nunique() > 1 and y.value_counts().min() >= 2 else None
+    return train_test_split(new_data, test_size=HOLDOUT_FRACTION, stratify=stratify, random_state=RANDOM_STATE)
+
+
+# Holdout log loss of the current and candidate models; the candidate may
+# only be promoted if it is no worse than tolerance on every check, and at
+# least one check ran
+def promotion_checks(current, candidate, X_hold, y_hold, reference_holdout, tolerance):
+    checks = {}
+    if X_hold is not None:
+        checks['new_days'] = (holdout_loss(current, X_hold, y_hold), holdout_loss(candidate, X_hold, y_hold))
+    if reference_holdout:
+        X_ref, y_ref = split_features(pd.read_parquet(reference_holdout))
+        checks['reference'] = (holdout_loss(current, X_ref, y_ref), holdout_loss(candidate, X_ref, y_ref))
+    accepted = bool(checks) and all(new <= old * (1 + tolerance) for old, new in checks.values())
+    return checks, accepted
+
+
+# Hyperparameters carried over from the current model. They are read one
+# attribute at a time because models pickled by older XGBoost releases lack
+# newer estimator fields, which breaks get_params()
+CARRIED_PARAMS = ['max_depth', 'learning_rate', 'scale_pos_weight', 'subsample', 'colsample_bytree',
+                  'min_child_weight', 'gamma', 'reg_alpha', 'reg_lambda', 'tree_method']
+
+
+# Append boosting rounds to the rounds the current model predicts with
+def continue_training(current, X, y, rounds, cores):
+    from xgboost import XGBClassifier
+
+    params = {name: getattr(current, name, None) for name in CARRIED_PARAMS}
+    params = {name: value for name, value in params.items() if value is not None}
+    updated = XGBClassifier(n_estimators=rounds, n_jobs=cores, **params)
+    # Rounds past the early-stopping point are dropped rather than revived,
+    # and so are the marks, so predictions use the appended rounds too
+    booster = current.get_booster()
+    best_iteration = booster.attr('best_iteration')
+    booster = booster[:int(best_iteration) + 1] if best_iteration is not None else booster.copy()
+    booster.set_attr(best_iteration=None, best_score=None)
+    updated.fit(X, y, xgb_model=booster, verbose=False)
+    return updated
+
+
+# The client's JSON export is refreshed too, so it never needs xgboost
+def promote(model_path, live_model):
+    tmp_path = f'{live_model}.tmp'
+    with open(model_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        dst.write(src.read())
+    os.replace(tmp_path, live_model)
+    tree_model.export_json(live_model, os.path.splitext(live_model)[0] + '.json')
+
+
+# Rebuild from the whole table except the new days' holdout rows, so the
+# promotion check scores the rebuild on rows it never trained on
+def full_rebuild(table_dir, artifacts_dir, cores, trained_through=None, new_train=None):
+    with tempfile.TemporaryDirectory() as workdir:
+        data_file = os.path.join(workdir, 'weather_events.parquet')
+        if new_train is None:
+            feature_table.consolidate(table_dir, data_file)
+        else:
+            new_days = {day for day, _ in new_partitions(table_dir, trained_through)}
+            seen = [path for day, path in new_partitions(table_dir, None) if day not in new_days]
+            data = pd.concat([pd.read_parquet(path) for path in seen] + [new_train], ignore_index=True)
+            feature_table.write_atomic_parquet(data, data_file)
+        xgb_cores, cat_cores = train_pipeline.default_cores() if cores is None else (cores, cores)
+        return train_pipeline.run(data_file, artifacts_dir, xgb_cores, cat_cores)
+
+
+def run(table_dir, live_model, artifacts_dir, state_file, rounds, tolerance, reference_holdout,
+        full_rebuild_every, force_full, cores, trained_through=None):
+    state = load_state(state_file)
+    if trained_through:
+        state['trained_through'] = trained_through
+    # Without it every partition counts as new and rounds would be appended
+    # for days the live model was already trained on
+    if state['trained_through'] is None and not force_full:
+        raise ValueError('The last day the live model covers is unknown; pass --trained-through '
+                         'or run a full rebuild with --full')
+    partitions = new_partitions(table_dir, state['trained_through'])
+    if not partitions and not force_full:
+        print("No new partitions since", state['trained_through'])
+        return None
+
+    version = time.strftime('%Y%m%dT%H%M%S')
+    last_day = partitions[-1][0] if partitions else state['trained_through']
+
+    train = X_train = X_hold = y_train = y_hold = None
+    if partitions:
+        train, hold = split_new_days(partitions)
+        X_train, y_train = split_features(train)
+        X_hold, y_hold = split_features(hold)
+    with open(live_model, 'rb') as file:
+        current = pickle.load(file)
+
+    # Periodic full rebuild keeps appended rounds from drifting too far. It
+    # passes the same holdout checks as an incremental update; a rejected
+    # rebuild leaves the live model and the counter alone, so the next run
+    # tries again.
+    if force_full or state['updates_since_full'] + 1 >= full_rebuild_every:
+        version_dir, manifest = full_rebuild(table_dir, artifacts_dir, cores, state['trained_through'], train)
+        candidate_path = os.path.join(version_dir, 'xgb_model.pkl')
+        with open(candidate_path, 'rb') as file:
+            candidate = pickle.load(file)
+        checks, accepted = promotion_checks(current, candidate, X_hold, y_hold, reference_holdout, tolerance)
+        if not checks:
+            print("No new days or --reference-holdout to check the rebuild against; not promoting")
+        result = {'version': manifest['version'], 'mode': 'full', 'through': last_day,
+                  'holdout_log_loss': {name: {'current': old, 'updated': new} for name, (old, new) in checks.items()},
+                  'promoted': accepted}
+        if accepted:
+            promote(candidate_path, live_model)
+            state.update({'trained_through': last_day, 'updates_since_full': 0})
+        state['history'].append({key: result[key] for key in ('version', 'mode', 'promoted')})
+        save_state(state, state_file)
+        return result
+
+    start = time.perf_counter()
+    updated = continue_training(current, X_train, y_train, rounds, cores)
+    fit_seconds = time.perf_counter() - start
+    checks, accepted = promotion_checks(current, updated, X_hold, y_hold, reference_holdout, tolerance)
+
+    version_dir = os.path.join(artifacts_dir, f'{version}-incremental')
+    os.makedirs(version_dir, exist_ok=True)
+    candidate_path = os.path.join(version_dir, 'xgb_model.pkl')
+    with open(candidate_path, 'wb') as file:
+        pickle.dump(updated, file)
+    result = {
+        'version': os.path.basename(version_dir),
+        'mode': 'incremental',
+        'days': [day for day, _ in partitions],
+        'rows': int(len(X_train) + len(X_hold)),
+        'rounds': rounds,
+        'fit_seconds': fit_seconds,
+        'holdout_log_loss': {name: {'current': old, 'updated': new} for name, (old, new) in checks.items()},
+        'promoted': accepted,
+    }
+    with open(os.path.join(version_dir, 'manifest.json'), 'w') as file:
+        json.dump(result, file, indent=2)
+
+    # Rejected candidates are kept for inspection; the live model is untouched
+    # and the days stay pending so the next run retries them
+    if accepted:
+        promote(candidate_path, live_model)
+        state['trained_through'] = last_day
+        state['updates_since_full'] += 1
+    state['history'].append({key: result[key] for key in ('version', 'mode', 'promoted')})
+    save_state(state, state_file)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Append boosting rounds for newly labeled days to the live model')
+    parser.add_argument('--table-dir', default=feature_table.OUTPUT_DIR)
+    parser.add_argument('--live-model', default=LIVE_MODEL)
+    parser.add_argument('--artifacts', default=ARTIFACTS_DIR)
+    parser.add_argument('--state', default=STATE_FILE)
+    parser.add_argument('--rounds', type=int, default=NEW_ROUNDS)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--reference-holdout', help='fixed labeled parquet the update must not regress on')
+    parser.add_argument('--full-rebuild-every', type=int, default=FULL_REBUILD_EVERY)
+    parser.add_argument('--full', action='store_true', help='force a full rebuild')
+    parser.add_argument('--cores', type=int)
+    parser.add_argument('--trained-through',
+                        help='last day (YYYY-MM-DD) the live model already covers; required on the first run')
+    args = parser.parse_args()
+
+    try:
+        result = run(args.table_dir, args.live_model, args.artifacts, args.state, args.rounds, args.tolerance,
+                     args.reference_holdout, args.full_rebuild_every, args.full, args.cores,
+                     args.trained_through)
+    except ValueError as e:
+        parser.error(str(e))
+    if result is not None:
+        print(json.dumps(result, indent=2))
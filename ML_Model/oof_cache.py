@@ -0,0 +1,145 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import log_loss
+from sklearn.model_selection import StratifiedKFold, train_test_split
+
+from train_pipeline import DATA_FILE, RANDOM_STATE, class_weight, default_cores, load_data
+
+# Cached base-model predictions for blender experiments. The notebook's
+# StackingClassifier(cv=3) refits both boosted models on every fold each time
+# the final estimator changes. Here the out-of-fold predictions on the train
+# split and the full-fit predictions on the held-out split are computed once,
+# keyed by the data hash, fold seed and base-model parameters, and reused by
+# every blender fit.
+
+script_dir = os.path.dirname(__file__)
+CACHE_DIR = os.path.join(script_dir, 'oof_cache')
+
+# Base models of the stacked ensemble in ml_projectTOTO.ipynb
+STACK_XGB_PARAMS = {'max_depth': 9, 'learning_rate': 0.1}
+STACK_CAT_PARAMS = {'depth': 9, 'learning_rate': 0.1}
+BASE_MODELS = ['xgb', 'cat']
+
+
+def data_hash(X, y):
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(X, index=True).to_numpy().tobytes())
+    digest.update(pd.util.hash_pandas_object(y, index=True).to_numpy().tobytes())
+    digest.update(json.dumps(list(X.columns)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_key(X, y, n_folds, fold_seed, test_size, xgb_params, cat_params):
+    spec = {'data': data_hash(X, y), 'n_folds': n_folds, 'fold_seed': fold_seed, 'test_size': test_size,
+            'xgb': xgb_params, 'cat': cat_params}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:16], spec
+
+
+# Fit one base model and return its positive-class probabilities on X_pred
+def fit_predict(kind, params, X_fit, y_fit, X_pred, weight, cores):
+    if kind == 'xgb':
+        from xgboost import XGBClassifier
+        model = XGBClassifier(scale_pos_weight=weight, n_jobs=cores, **params)
+    else:
+        from catboost import CatBoostClassifier
+        model = CatBoostClassifier(scale_pos_weight=weight, thread_count=cores, verbose=False,
+                                   save_snapshot=False, allow_writing_files=False, **params)
+    model.fit(X_fit, y_fit)
+    return model.predict_proba(X_pred)[:, 1]
+
+
+def build_cache(X, y, n_folds, fold_seed, test_size, xgb_params, cat_params, workers, cores_per_fit):
+    weight = class_weight(y)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, stratify=y,
+                                                        random_state=RANDOM_STATE)
+    folds = list(StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=fold_seed).split(X_train, y_train))
+    params = {'xgb': xgb_params, 'cat': cat_params}
+
+    oof = np.zeros((len(X_train), len(BASE_MODELS)))
+    test_pred = np.zeros((len(X_test), len(BASE_MODELS)))
+    # Every fold fit and the full-train fit of each base model are independent
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {}
+        for column, kind in enumerate(BASE_MODELS):
+            for fit_index, pred_index in folds:
+                future = pool.submit(fit_predict, kind, params[kind], X_train.iloc[fit_index],
+                                     y_train.iloc[fit_index], X_train.iloc[pred_index], weight, cores_per_fit)
+                jobs[future] = (oof, column, pred_index)
+            future = pool.submit(fit_predict, kind, params[kind], X_train, y_train, X_test, weight, cores_per_fit)
+            jobs[future] = (test_pred, column, slice(None))
+        for future, (target, column, rows) in jobs.items():
+            target[rows, column] = future.result()
+
+    return {'oof': oof, 'test_pred': test_pred, 'y_train': y_train.to_numpy(), 'y_test': y_test.to_numpy(),
+            'train_index': X_train.index.to_numpy(), 'test_index': X_test.index.to_numpy(),
+            'weight': np.array(weight)}
+
+
+def load_or_build(X, y, cache_dir=CACHE_DIR, n_folds=3, fold_seed=RANDOM_STATE, test_size=0.2,
+                  xgb_params=STACK_XGB_PARAMS, cat_params=STACK_CAT_PARAMS, workers=None, cores_per_fit=1):
+    key, spec = cache_key(X, y, n_folds, fold_seed, test_size, xgb_params, cat_params)
+    path = os.path.join(cache_dir, f'{key}.npz')
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            return key, dict(cached), True
+
+    workers = workers or os.cpu_count() or 1
+    arrays = build_cache(X, y, n_folds, fold_seed, test_size, xgb_params, cat_params, workers, cores_per_fit)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = os.path.join(cache_dir, f'{key}.tmp.npz')
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    with open(os.path.join(cache_dir, f'{key}.json'), 'w') as file:
+        json.dump(spec, file, indent=2)
+    return key, arrays, False
+
+
+# Final estimators from ml_projectTOTO.ipynb and blender_model_build.ipynb
+def make_blender(name, weight, params):
+    if name == 'logreg':
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+        options = {'class_weight': 'balanced', 'solver': 'saga', 'max_iter': 1000}
+        options.update(params)
+        return make_pipeline(StandardScaler(), LogisticRegression(**options))
+    from xgboost import XGBClassifier
+    options = {'scale_pos_weight': float(weight), 'max_depth': 10}
+    options.update(params)
+    return XGBClassifier(**options)
+
+
+def fit_blender(cache, name='logreg', params=None):
+    blender = make_blender(name, cache['weight'], params or {})
+    blender.fit(cache['oof'], cache['y_train'])
+    proba = blender.predict_proba(cache['test_pred'])[:, 1]
+    return blender, float(log_loss(cache['y_test'], proba, labels=[0, 1]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fit a blender on cached out-of-fold base-model predictions')
+    parser.add_argument('--data', default=DATA_FILE)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--fold-seed', type=int, default=RANDOM_STATE)
+    parser.add_argument('--workers', type=int, default=sum(default_cores()))
+    parser.add_argument('--blender', choices=['logreg', 'xgb'], default='logreg')
+    parser.add_argument('--blender-params', default='{}', help='JSON keyword arguments for the blender')
+    args = parser.parse_args()
+
+    X, y = load_data(args.data)
+    start = time.perf_counter()
+    key, cache, hit = load_or_build(X, y, args.cache_dir, args.folds, args.fold_seed, workers=args.workers)
+    cached = time.perf_counter()
+    blender, test_log_loss = fit_blender(cache, args.blender, json.loads(args.blender_params))
+    fitted = time.perf_counter()
+
+    print(f"Cache {key} {'hit' if hit else 'built'} in {cached - start:.1f}s")
+    print(f"{args.blender} blender fit in {fitted - cached:.2f}s, test log loss {test_log_loss:.4f}")
@@ -0,0 +1,230 @@
+import argparse
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import log_loss, precision_score, recall_score
+from sklearn.model_selection import train_test_split
+
+# Command-line version of blender_model_build.ipynb. XGBoost and CatBoost are
+# fit at the same time in separate processes, each with its own core budget,
+# then the XGBoost blender is fit on their stacked predictions. Every run
+# writes versioned artifacts plus a manifest with per-stage timings.
+
+script_dir = os.path.dirname(__file__)
+DATA_FILE = os.path.join(script_dir, 'weather_events.parquet')
+ARTIFACTS_DIR = os.path.join(script_dir, 'artifacts')
+
+# Columns that are not model features
+ID_COLUMNS = ['tornado', 'time', 'county_name', 'location_id']
+RANDOM_STATE = 96
+
+# Hyperparameters from blender_model_build.ipynb
+XGB_PARAMS = {'learning_rate': 0.3, 'max_depth': 9, 'early_stopping_rounds': 100}
+CAT_PARAMS = {'learning_rate': 0.3, 'depth': 9, 'early_stopping_rounds': 100}
+BLENDER_PARAMS = {'learning_rate': 0.3, 'max_depth': 9, 'early_stopping_rounds': 10}
+
+
+class StageTimer:
+    def __init__(self):
+        self.timings = {}
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+
+class _Stage:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        print(f"[{self.name}] started")
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.timer.timings[self.name] = elapsed
+        print(f"[{self.name}] {elapsed:.1f}s")
+        return False
+
+
+def load_data(data_file=DATA_FILE):
+    data = pd.read_parquet(data_file)
+    X = data.drop(columns=ID_COLUMNS)
+    y = data['tornado']
+    return X, y
+
+
+# Same 60/20/20 stratified train/validation/test split as the notebook
+def split_data(X, y, random_state=RANDOM_STATE):
+    X_train_val, X_test, y_train_val, y_test = train_test_split(X, y, test_size=0.2, stratify=y,
+                                                                random_state=random_state)
+    X_train, X_val, y_train, y_val = train_test_split(X_train_val, y_train_val, test_size=0.25,
+                                                      stratify=y_train_val, random_state=random_state)
+    return X_train, X_val, X_test, y_train, y_val, y_test
+
+
+def class_weight(y):
+    counts = y.value_counts()
+    return counts[0] / counts[1]
+
+
+# Base model fits run in worker processes; each returns the fitted model and
+# its predicted probabilities on every split so the parent can build the stack
+def fit_xgb(X_train, y_train, X_val, y_val, splits, weight, cores, params=XGB_PARAMS):
+    from xgboost import XGBClassifier
+
+    start = time.perf_counter()
+    model = XGBClassifier(scale_pos_weight=weight, n_jobs=cores, **params)
+    model.fit(X_train, y_train, eval_set=[(X_val, y_val)], verbose=False)
+    fit_seconds = time.perf_counter() - start
+    preds = {name: model.predict_proba(X)[:, 1] for name, X in splits.items()}
+    return model, preds, fit_seconds
+
+
+def fit_cat(X_train, y_train, X_val, y_val, splits, weight, cores, params=CAT_PARAMS):
+    from catboost import CatBoostClassifier
+
+    start = time.perf_counter()
+    model = CatBoostClassifier(scale_pos_weight=weight, thread_count=cores, verbose=False,
+                               save_snapshot=False, allow_writing_files=False, **params)
+    model.fit(X_train, y_train, eval_set=(X_val, y_val))
+    fit_seconds = time.perf_counter() - start
+    preds = {name: model.predict_proba(X)[:, 1] for name, X in splits.items()}
+    return model, preds, fit_seconds
+
+
+def fit_base_models(X_train, y_train, X_val, y_val, splits, weight, xgb_cores, cat_cores):
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        xgb_future = pool.submit(fit_xgb, X_train, y_train, X_val, y_val, splits, weight, xgb_cores)
+        cat_future = pool.submit(fit_cat, X_train, y_train, X_val, y_val, splits, weight, cat_cores)
+        return xgb_future.result(), cat_future.result()
+
+
+def fit_blender(train_stack, y_train, val_stack, y_val, weight, cores, params=BLENDER_PARAMS):
+    from xgboost import XGBClassifier
+
+    blender = XGBClassifier(scale_pos_weight=weight, n_jobs=cores, **params)
+    blender.fit(train_stack, y_train, eval_set=[(val_stack, y_val)], verbose=False)
+    return blender
+
+
+def evaluate(y_true, proba, threshold=0.5):
+    y_pred = (proba > threshold).astype(int)
+    return {'log_loss': float(log_loss(y_true, proba, labels=[0, 1])),
+            'precision': float(precision_score(y_true, y_pred, zero_division=0)),
+            'recall': float(recall_score(y_true, y_pred, zero_division=0))}
+
+
+def save_artifacts(version_dir, xgb_model, cat_model, blender, manifest):
+    os.makedirs(version_dir, exist_ok=True)
+    with open(os.path.join(version_dir, 'xgb_model.pkl'), 'wb') as file:
+        pickle.dump(xgb_model, file)
+    cat_model.save_model(os.path.join(version_dir, 'cat_model.cbm'))
+    with open(os.path.join(version_dir, 'blender_model.pkl'), 'wb') as file:
+        pickle.dump(blender, file)
+    with open(os.path.join(version_dir, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+
+# Point artifacts/LATEST at a version directory
+def mark_latest(artifacts_dir, version):
+    tmp_path = os.path.join(artifacts_dir, 'LATEST.tmp')
+    with open(tmp_path, 'w') as file:
+        file.write(version + '\n')
+    os.replace(tmp_path, os.path.join(artifacts_dir, 'LATEST'))
+
+
+def latest_version_dir(artifacts_dir=ARTIFACTS_DIR):
+    with open(os.path.join(artifacts_dir, 'LATEST')) as file:
+        return os.path.join(artifacts_dir, file.read().strip())
+
+
+def default_cores():
+    cores = os.cpu_count() or 1
+    return max(cores // 2, 1), max(cores - cores // 2, 1)
+
+
+def run(data_file, artifacts_dir, xgb_cores, cat_cores, version=None):
+    timer = StageTimer()
+    version = version or time.strftime('%Y%m%dT%H%M%S')
+    version_dir = os.path.join(artifacts_dir, version)
+
+    with timer.stage('load'):
+        X, y = load_data(data_file)
+    with timer.stage('split'):
+        X_train, X_val, X_test, y_train, y_val, y_test = split_data(X, y)
+        weight = class_weight(y)
+        splits = {'train': X_train, 'val': X_val, 'test': X_test}
+
+    with timer.stage('base_models'):
+        (xgb_model, xgb_preds, xgb_fit), (cat_model, cat_preds, cat_fit) = fit_base_models(
+            X_train, y_train, X_val, y_val, splits, weight, xgb_cores, cat_cores)
+    timer.timings['xgb_fit'] = xgb_fit
+    timer.timings['cat_fit'] = cat_fit
+
+    with timer.stage('blender'):
+        stacks = {name: np.column_stack((xgb_preds[name], cat_preds[name])) for name in splits}
+        blender = fit_blender(stacks['train'], y_train, stacks['val'], y_val, weight, xgb_cores + cat_cores)
+
+    with timer.stage('evaluate'):
+        scores = {
+            'xgb': evaluate(y_test, xgb_preds['test']),
+            'cat': evaluate(y_test, cat_preds['test']),
+            'blender': evaluate(y_test, blender.predict_proba(stacks['test'])[:, 1]),
+        }
+
+    manifest = {
+        'version': version,
+        'data_file': os.path.abspath(data_file),
+        'rows': int(len(X)),
+        'features': list(X.columns),
+        'scale_pos_weight': float(weight),
+        'cores': {'xgb': xgb_cores, 'cat': cat_cores},
+        'params': {'xgb': XGB_PARAMS, 'cat': CAT_PARAMS, 'blender': BLENDER_PARAMS},
+        'best_iteration': {'xgb': int(xgb_model.best_iteration), 'cat': int(cat_model.get_best_iteration())},
+        'test_scores': scores,
+        'timings_s': timer.timings,
+    }
+    with timer.stage('save'):
+        save_artifacts(version_dir, xgb_model, cat_model, blender, manifest)
+        mark_latest(artifacts_dir, version)
+
+    # Re-write the manifest so it includes the save stage
+    with open(os.path.join(version_dir, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return version_dir, manifest
+
+
+if __name__ == "__main__":
+    xgb_default, cat_default = default_cores()
+    parser = argparse.ArgumentParser(description='Train the XGBoost, CatBoost and blender models')
+    parser.add_argument('--data', default=DATA_FILE)
+    parser.add_argument('--artifacts', default=ARTIFACTS_DIR)
+    parser.add_argument('--xgb-cores', type=int, default=xgb_default)
+    parser.add_argument('--cat-cores', type=int, default=cat_default)
+    parser.add_argument('--version', help='artifact version name, defaults to a timestamp')
+    parser.add_argument('--promote', action='store_true',
+                        help='also copy the new xgb_model.pkl next to the RTS client')
+    args = parser.parse_args()
+
+    version_dir, manifest = run(args.data, args.artifacts, args.xgb_cores, args.cat_cores, args.version)
+    print(json.dumps({'version': manifest['version'], 'test_scores': manifest['test_scores'],
+                      'timings_s': manifest['timings_s']}, indent=2))
+
+    if args.promote:
+        live_model = os.path.join(script_dir, '..', 'RTS', 'xgb_model.pkl')
+        shutil.copy(os.path.join(version_dir, 'xgb_model.pkl'), live_model)
+        # Refresh the client's JSON export too, so the client never needs xgboost
+        sys.path.append(os.path.join(script_dir, '..', 'RTS'))
+        import tree_model
+        tree_model.export_json(live_model, tree_model.MODEL_JSON)
+        print("Promoted xgb_model.pkl and xgb_model.json to RTS/")
@@ -0,0 +1,173 @@
+import json
+import queue
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+from datetime import datetime, timedelta
+
+import metrics
+
+# Threshold alerting for county risk, evaluated inside the RTS client as each
+# score is produced. Each county holds a few fields of state, so an update is
+# O(1): hysteresis keeps a county in its band until risk falls clearly below
+# the threshold, a minimum dwell time filters one-hour blips, and alerts are
+# only raised on band transitions; de-escalations are rate-limited per county.
+# Dwell and rate-limit windows use event time so replays behave like live runs.
+
+# Risk bands from most to least severe, matching the dashboard colors
+DEFAULT_BANDS = [('red', 0.85), ('yellow', 0.5)]
+CLEAR_BAND = 'green'
+DEFAULT_HYSTERESIS = 0.05
+DEFAULT_MIN_DWELL = timedelta(0)
+DEFAULT_RATE_LIMIT = 4
+DEFAULT_RATE_WINDOW = timedelta(hours=6)
+
+alert_latency_seconds = metrics.register(metrics.Histogram(
+    'rts_alert_latency_seconds', 'Time from record arrival to alert emission', 'band'))
+alerts_total = metrics.register(metrics.Counter(
+    'rts_alerts_total', 'Alerts emitted by band', 'band'))
+alerts_suppressed_total = metrics.register(metrics.Counter(
+    'rts_alerts_suppressed_total', 'Band transitions that did not raise an alert', 'reason'))
+
+
+class StdoutSink:
+    def emit(self, alert):
+        print(json.dumps(alert), file=sys.stdout, flush=True)
+
+    def close(self):
+        pass
+
+
+# Append alerts as JSON lines
+class FileSink:
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def emit(self, alert):
+        self.file.write(json.dumps(alert) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# POST alerts to a local webhook from a background thread so a slow
+# receiver never blocks scoring; alerts are dropped when the queue is full
+class WebhookSink:
+    def __init__(self, url, max_queue=1000, timeout=2.0):
+        self.url = url
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def emit(self, alert):
+        try:
+            self.queue.put_nowait(alert)
+        except queue.Full:
+            alerts_suppressed_total.inc('webhook_queue_full')
+
+    def _run(self):
+        while True:
+            alert = self.queue.get()
+            if alert is None:
+                return
+            request = urllib.request.Request(self.url, data=json.dumps(alert).encode('utf-8'),
+                                             headers={'Content-type': 'application/json'})
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except OSError as e:
+                print(f"Alert webhook failed: {e}", file=sys.stderr)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(timeout=self.timeout)
+
+
+class AlertEngine:
+    def __init__(self, sinks=None, bands=DEFAULT_BANDS, hysteresis=DEFAULT_HYSTERESIS,
+                 min_dwell=DEFAULT_MIN_DWELL, rate_limit=DEFAULT_RATE_LIMIT,
+                 rate_window=DEFAULT_RATE_WINDOW, alert_on_clear=True):
+        self.sinks = list(sinks or [])
+        self.bands = sorted(bands, key=lambda band: band[1], reverse=True)
+        self.band_names = [name for name, _ in self.bands] + [CLEAR_BAND]
+        self.clear_index = len(self.bands)
+        self.hysteresis = hysteresis
+        self.min_dwell = min_dwell
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.alert_on_clear = alert_on_clear
+        # county -> [band index, pending band index, pending since, recent alert times]
+        self._state = {}
+
+    # Most severe band the risk qualifies for; a county already in a band
+    # only leaves it once risk drops below the threshold minus hysteresis
+    def _target_band(self, risk, current):
+        for i, (_, threshold) in enumerate(self.bands):
+            limit = threshold - self.hysteresis if current <= i else threshold
+            if risk > limit:
+                return i
+        return self.clear_index
+
+    def update(self, county, risk, event_time, arrival=None, trace_id=None):
+        if isinstance(event_time, str):
+            event_time = datetime.fromisoformat(event_time)
+        state = self._state.get(county)
+        if state is None:
+            state = self._state[county] = [self.clear_index, None, None, deque(maxlen=max(self.rate_limit, 1))]
+        current, pending, pending_since, recent = state
+
+        target = self._target_band(risk, current)
+        if target == current:
+            state[1] = state[2] = None
+            return None
+
+        # Wait for the new band to hold for the minimum dwell time
+        if pending != target:
+            state[1], state[2] = target, event_time
+            pending_since = event_time
+        if event_time - pending_since < self.min_dwell:
+            return None
+
+        state[0] = target
+        state[1] = state[2] = None
+        if target == self.clear_index and not self.alert_on_clear:
+            alerts_suppressed_total.inc('clear')
+            return None
+
+        # Rate limit: at most rate_limit alerts per county within rate_window.
+        # The band has already changed, so a suppressed alert is never
+        # raised later; escalations therefore always go out, and count
+        # towards the limit for the alerts after them
+        escalation = target < current
+        if not escalation and len(recent) == recent.maxlen and event_time - recent[0] < self.rate_window:
+            alerts_suppressed_total.inc('rate_limited')
+            return None
+        recent.append(event_time)
+
+        alert = {
+            'county': county,
+            'band': self.band_names[target],
+            'previous_band': self.band_names[current],
+            'escalation': escalation,
+            'risk': float(risk),
+            'time': event_time.isoformat(),
+            'trace_id': trace_id,
+            'emitted_at': time.time(),
+        }
+        for sink in self.sinks:
+            sink.emit(alert)
+        alerts_total.inc(alert['band'])
+        if arrival is not None:
+            alert_latency_seconds.observe(alert['band'], time.time() - arrival)
+        return alert
+
+    def band(self, county):
+        state = self._state.get(county)
+        return self.band_names[state[0] if state else self.clear_index]
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
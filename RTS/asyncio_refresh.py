@@ -1,66 +1,450 @@
+import argparse
 import asyncio
 import aiohttp
-import pandas as pd
 import json
-import pickle
-import xgboost
+import time
 import os
+import sys
+import urllib.parse
+from datetime import timedelta
+from operator import itemgetter
 
-# Load the XGBoost model
-script_dir = os.path.dirname(__file__)
-model_path = os.path.join(script_dir, 'xgb_model.pkl')
-
-with open(model_path, 'rb') as file:
-    model = pickle.load(file)
-
-# Define the features the model was trained on
-features = ['temperature_2m', 'relative_humidity_2m', 'rain', 'pressure_msl', 'surface_pressure', 
-            'wind_speed_10m', 'wind_speed_100m', 'wind_direction_10m', 'wind_direction_100m', 
-            'soil_temperature_0_to_7cm', 'wind_shear']
-
-# Function to update predictions in the Parquet file
-def update_predictions(new_record, model, features, parquet_file='tornado_risk.parquet'):
-    # Extract the timestamp and county from the new record
-    new_time = new_record['time']
-    county = new_record['county_name']
-    
-    # Extract features for prediction
-    X = pd.DataFrame([new_record])[features].values.reshape(1, -1)
-    
-    # Make a prediction (probability of positive class)
-    pred = model.predict_proba(X)[0][1]
-    
-    # Load existing data
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import metrics
+from alerts import AlertEngine, FileSink, StdoutSink, WebhookSink
+from event_time import ACCEPTED, DUPLICATE, TickTracker
+from explain import DEFAULT_THRESHOLD, DEFAULT_TOP_FEATURES, Explainer
+from ingest_log import LOG_DIR, IngestLog
+from risk_index import QUERY_PORT, RiskIndex, start_query_server
+from shadow import REPORT_FILE as SHADOW_REPORT_FILE, ShadowScorer
+from spatial import ADJACENCY_FILE, NEIGHBOR_SUFFIXES, CountyGraph, neighbor_fields
+from tree_model import MODEL_JSON, load_model, load_model_file
+
+# Load the XGBoost model, compiled for NumPy scoring (see tree_model.py) so
+# scoring never imports xgboost or pandas
+model = load_model()
+
+# Define the features the model was trained on, in the order fixed when the
+# model is loaded. Retrained models carry their own feature names, which may
+# include neighbor features from spatial.py
+features = model.feature_names or [
+    'temperature_2m', 'relative_humidity_2m', 'rain', 'pressure_msl', 'surface_pressure',
+    'wind_speed_10m', 'wind_speed_100m', 'wind_direction_10m', 'wind_direction_100m',
+    'soil_temperature_0_to_7cm', 'wind_shear']
+
+# County adjacency for the neighborhood risk channel and neighbor features
+county_graph = CountyGraph.load(ADJACENCY_FILE) if os.path.exists(ADJACENCY_FILE) else None
+
+# Port for the local Prometheus /metrics endpoint
+METRICS_PORT = 8001
+
+# Latency and freshness metrics for the client side of the pipeline
+stage_seconds = metrics.register(metrics.Histogram(
+    'rts_client_stage_seconds', 'Time spent in each client pipeline stage', 'stage'))
+end_to_end_seconds = metrics.register(metrics.Histogram(
+    'rts_client_end_to_end_seconds', 'Time from server emit to a persisted prediction', 'stage'))
+county_freshness = metrics.register(metrics.AgeGauge(
+    'rts_county_freshness_seconds', 'Seconds since the server emitted the latest persisted record for each county', 'county'))
+records_total = metrics.register(metrics.Counter(
+    'rts_client_records_total', 'Records received by event-time status', 'status'))
+feed_records_total = metrics.register(metrics.Counter(
+    'rts_feed_records_total', 'Records received from each feed', 'feed'))
+feed_lag_seconds = metrics.register(metrics.Histogram(
+    'rts_feed_lag_seconds', 'Time from server emit to client arrival for each feed', 'feed'))
+feed_freshness = metrics.register(metrics.AgeGauge(
+    'rts_feed_freshness_seconds', 'Seconds since each feed last delivered a record', 'feed'))
+feed_reconnects_total = metrics.register(metrics.Counter(
+    'rts_feed_reconnects_total', 'Reconnects after a feed connection failed', 'feed'))
+
+# Current risk, top-K and history served from memory by the query API
+risk_index = RiskIndex()
+
+# Threshold alerts; sinks are attached from the command line
+alert_engine = AlertEngine()
+
+# Counties expected in every hourly tick
+EXPECTED_COUNTIES = 99
+
+DEFAULT_URL = 'http://localhost:8000'
+# Feeds are read with one pooled session; a feed that sends nothing for
+# FEED_READ_TIMEOUT seconds is reconnected, with exponential backoff, and
+# given up after RECONNECT_ATTEMPTS failures in a row
+MAX_CONNECTIONS = 32
+FEED_READ_TIMEOUT = 60.0
+RECONNECT_ATTEMPTS = 5
+RECONNECT_BACKOFF = 0.5
+MAX_RECONNECT_BACKOFF = 30.0
+
+SNAPSHOT_SCHEMA = pa.schema([('time', pa.string()), ('county', pa.string()), ('risk', pa.float64()),
+                             ('neighborhood_risk', pa.float64()), ('trace_id', pa.string()),
+                             ('emit_ts', pa.float64())])
+SNAPSHOT_COLUMNS = SNAPSHOT_SCHEMA.names
+
+# Function to load the last snapshot so counties keep their risk across restarts.
+# ParquetFile reads without pyarrow.dataset, which would import pandas
+def load_snapshot(parquet_file):
     try:
-        df = pd.read_parquet(parquet_file)
+        rows = pq.ParquetFile(parquet_file).read().to_pylist()
     except FileNotFoundError:
-        df = pd.DataFrame(columns=['time', 'county', 'risk'])
-    
-    # Remove the existing record for the county if it exists
-    df = df[df['county'] != county]
-    
-    # Append the new prediction
-    new_prediction = pd.DataFrame([{'time': new_time, 'county': county, 'risk': pred}])
-    df = pd.concat([df, new_prediction], ignore_index=True)
-    
-    # Ensure the directory exists
-    #os.makedirs(os.path.dirname(parquet_file), exist_ok=True)
-    
-    # Save back to the Parquet file
-    df.to_parquet(parquet_file)
-
-# Async function to stream data from the server
-async def stream_data(url, model, features):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            async for line in response.content:
-                if line:
-                    record = json.loads(line.decode('utf-8'))
-                    update_predictions(record, model, features)
+        return {}
+    return {row['county']: row for row in rows}
+
+# Snapshot columns are built straight from NumPy buffers: converting Python
+# lists with pa.array probes for, and imports, pandas on the first tick
+def _validity(values):
+    present = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+    return None if present.all() else pa.py_buffer(np.packbits(present, bitorder='little'))
+
+def _column(values, type):
+    if type == pa.float64():
+        data = np.fromiter((np.nan if value is None else value for value in values), dtype=np.float64,
+                           count=len(values))
+        return pa.Array.from_buffers(type, len(values), [_validity(values), pa.py_buffer(data)])
+    encoded = [b'' if value is None else value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(values) + 1, dtype=np.int32)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return pa.Array.from_buffers(type, len(values), [_validity(values), pa.py_buffer(offsets),
+                                                     pa.py_buffer(b''.join(encoded))])
+
+# Function to write the snapshot atomically so the dashboard never reads a partial file
+def write_snapshot(snapshot, parquet_file):
+    rows = list(snapshot.values())
+    table = pa.Table.from_arrays([_column([row.get(field.name) for row in rows], field.type)
+                                  for field in SNAPSHOT_SCHEMA], schema=SNAPSHOT_SCHEMA)
+    tmp_file = f'{parquet_file}.tmp'
+    pq.write_table(table, tmp_file)
+    os.replace(tmp_file, parquet_file)
+
+# Orders records by event time and scores them one hourly tick at a time, so
+# inference runs as one batch and the snapshot is written once per tick.
+# Stale or late records never overwrite newer risk; they are either dropped
+# or scored into the county's history only. With a county graph, each tick
+# also refreshes the neighborhood risk of every county and, if the model
+# uses them, neighbor mean/max weather features, with sparse products.
+# A shadow scorer, when given, rescores each tick with a candidate model on
+# its own worker thread. Without a parquet file nothing is persisted, as in
+# backtests.
+class ScoringPipeline:
+    def __init__(self, model, features, parquet_file='tornado_risk.parquet', expected_counties=EXPECTED_COUNTIES,
+                 allowed_lateness=timedelta(0), late_policy='history', index=None, alerts=None, graph=None,
+                 explainer=None, shadow=None):
+        self.model = model
+        self.features = features
+        # Records are copied straight into a reused float32 feature array
+        self.feature_getter = itemgetter(*features)
+        self.feature_array = np.empty((expected_counties, len(features)), dtype=np.float32)
+        self.parquet_file = parquet_file
+        self.late_policy = late_policy
+        self.index = risk_index if index is None else index
+        self.alerts = alert_engine if alerts is None else alerts
+        self.tracker = TickTracker(expected_counties, allowed_lateness)
+        self.snapshot = load_snapshot(parquet_file) if parquet_file else {}
+        # Serve the last persisted risk from the query API until new ticks arrive
+        rows = [row for row in self.snapshot.values() if row.get('risk') is not None]
+        self.index.update_many([row['county'] for row in rows], [row['time'] for row in rows],
+                               [row['risk'] for row in rows])
+        # Records older than the persisted hour only fill in history
+        for row in rows:
+            self.tracker.seed(row['county'], row['time'])
+        self.diverted = []
+        self.explainer = explainer
+        self.shadow = shadow
+        self.graph = graph
+        if graph is not None:
+            # Latest risk and neighbor-feature weather per county, in graph order
+            self.graph_risk = np.full(len(graph), np.nan)
+            for county, row in self.snapshot.items():
+                if county in graph.index:
+                    self.graph_risk[graph.index[county]] = row['risk']
+            # The candidate model may use neighbor features the primary does not
+            self.neighbor_fields = neighbor_fields(list(features) + (shadow.features if shadow else []))
+            self.weather = np.full((len(graph), len(self.neighbor_fields)), np.nan)
+
+    def handle(self, record, arrival=None, feed=None):
+        status, _, ticks = self.tracker.offer(record['county_name'], record['time'], (record, arrival), feed)
+        records_total.inc(status)
+        # Duplicates of the latest record are dropped; older records may fill history
+        if status not in (ACCEPTED, DUPLICATE) and self.late_policy == 'history':
+            self.diverted.append(record)
+        for tick, items in ticks:
+            self.score_tick(items)
+
+    # Feeds are registered before they stream so the watermark waits for them,
+    # and released when they end so they stop holding it back
+    def start_feed(self, feed):
+        self.tracker.add_source(feed)
+
+    def end_feed(self, feed):
+        for tick, items in self.tracker.remove_source(feed):
+            self.score_tick(items)
+
+    # Score whatever is still buffered, e.g. when the stream ends
+    def flush(self):
+        for tick, items in self.tracker.flush():
+            self.score_tick(items)
+        if self.diverted:
+            self.score_diverted()
+
+    # Add neighbor mean/max weather features to each record in place
+    def add_neighbor_features(self, records, update=True):
+        positions = self.graph.positions([record['county_name'] for record in records])
+        known = positions >= 0
+        if update and known.any():
+            self.weather[positions[known]] = np.array([[record[name] for name in self.neighbor_fields]
+                                                       for record, ok in zip(records, known) if ok], dtype=float)
+        columns = self.graph.neighbor_features(self.weather, self.neighbor_fields)
+        for name, values in columns.items():
+            column = np.where(positions >= 0, values[positions], np.nan)
+            for record, value in zip(records, column):
+                record[name] = value
+
+    def predict(self, records, update_neighbors=True):
+        # Extract features for prediction
+        with stage_seconds.time('features'):
+            if self.graph is not None and self.neighbor_fields:
+                self.add_neighbor_features(records, update_neighbors)
+            if len(records) > len(self.feature_array):
+                self.feature_array = np.empty((len(records), len(self.features)), dtype=np.float32)
+            X = self.feature_array[:len(records)]
+            X[:] = list(map(self.feature_getter, records))
+
+        # Make a prediction (probability of positive class) for the whole batch
+        with stage_seconds.time('inference'):
+            return self.model.predict_proba(X)[:, 1]
+
+    def score_tick(self, items):
+        records = [record for record, _ in items]
+        preds = self.predict(records)
+
+        for (record, arrival), pred in zip(items, preds):
+            county = record['county_name']
+            self.index.update(county, record['time'], pred)
+            self.alerts.update(county, pred, record['time'], arrival, record.get('trace_id'))
+            # Keep the trace ID and emit time so the dashboard can measure
+            # how long the record took to reach the map
+            self.snapshot[county] = {'time': record['time'], 'county': county, 'risk': pred,
+                                     'trace_id': record.get('trace_id'), 'emit_ts': record.get('emit_ts')}
+
+        # High-risk counties are explained on the explainer's worker thread
+        if self.explainer is not None:
+            self.explainer.submit(records, preds)
+        # The candidate model sees the same records, after the primary has scored them
+        if self.shadow is not None:
+            self.shadow.submit(records, preds)
+
+        if self.graph is not None:
+            with stage_seconds.time('spatial'):
+                self.update_neighborhood(records, preds)
+
+        if self.parquet_file:
+            with stage_seconds.time('persist'):
+                write_snapshot(self.snapshot, self.parquet_file)
+
+        persisted = time.time()
+        for record in records:
+            emit_ts = record.get('emit_ts')
+            if emit_ts is not None:
+                end_to_end_seconds.observe('persist', persisted - emit_ts)
+                county_freshness.set(record['county_name'], emit_ts)
+
+        if self.diverted:
+            self.score_diverted()
+
+    # Neighbors of this tick's counties change too, so every county's
+    # neighborhood risk is refreshed from one sparse product
+    def update_neighborhood(self, records, preds):
+        positions = self.graph.positions([record['county_name'] for record in records])
+        known = positions >= 0
+        self.graph_risk[positions[known]] = preds[known]
+        smoothed = self.graph.smooth(self.graph_risk)
+        for county, row in self.snapshot.items():
+            position = self.graph.index.get(county)
+            row['neighborhood_risk'] = row['risk'] if position is None else smoothed[position]
+
+    # Late records only reach history; they use, but do not overwrite, the
+    # current neighbor weather
+    def score_diverted(self):
+        records, self.diverted = self.diverted, []
+        for record, pred in zip(records, self.predict(records, update_neighbors=False)):
+            self.index.add_history(record['county_name'], record['time'], pred)
+
+# Record fields the client reads; the server leaves out everything else.
+# Neighbor features are computed here from their base weather fields.
+def subscription_fields(features):
+    fields = ['time', 'county_name'] + [name for name in features if not name.endswith(NEIGHBOR_SUFFIXES)]
+    return fields + [name for name in neighbor_fields(features) if name not in fields]
+
+# Server URL subscribing to a field list and, optionally, a county set.
+# Parameters already on the URL, e.g. a per-feed county set, are kept.
+def subscription_url(url, fields=None, counties=None):
+    parts = urllib.parse.urlsplit(url)
+    params = dict(urllib.parse.parse_qsl(parts.query))
+    if fields:
+        params.setdefault('fields', ','.join(fields))
+    if counties:
+        params.setdefault('counties', ','.join(counties))
+    return parts._replace(path=parts.path or '/', query=urllib.parse.urlencode(params)).geturl()
+
+# Short feed name for metrics and logs: host:port, plus the path if any
+def feed_name(url):
+    parts = urllib.parse.urlsplit(url)
+    return parts.netloc + (parts.path if parts.path not in ('', '/') else '')
+
+# Feed names for a list of URLs; feeds that share a host and path, e.g. two
+# county sets from one server, are told apart by their position
+def feed_names(urls):
+    names = [feed_name(url) for url in urls]
+    return [f'{name}#{i}' if names.count(name) > 1 else name for i, name in enumerate(names)]
+
+# Every raw line is appended to the ingest log, when one is given, before it
+# is scored
+def ingest(line, feed, pipeline, log=None):
+    arrival = time.time()
+    with stage_seconds.time('decode'):
+        record = json.loads(line)
+    if log is not None:
+        with stage_seconds.time('log'):
+            log.append(line, arrival, record['time'])
+    feed_records_total.inc(feed)
+    feed_freshness.set(feed, arrival)
+    # Ingest is the transit time from server emit to client arrival
+    if 'emit_ts' in record:
+        stage_seconds.observe('ingest', arrival - record['emit_ts'])
+        feed_lag_seconds.observe(feed, arrival - record['emit_ts'])
+    pipeline.handle(record, arrival, feed)
+
+# Read one feed until its server ends the stream. Connection errors and
+# stalls reconnect; records the server sends again are stale by event time.
+# Once the feed ends or gives up, it no longer holds back the watermark.
+async def consume_feed(session, url, pipeline, log=None, attempts=RECONNECT_ATTEMPTS, feed=None):
+    feed = feed or feed_name(url)
+    failures = 0
+    try:
+        while True:
+            try:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    async for line in response.content:
+                        line = line.rstrip(b'\n')
+                        if line:
+                            failures = 0
+                            ingest(line, feed, pipeline, log)
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                failures += 1
+                if failures > attempts:
+                    raise
+                delay = min(RECONNECT_BACKOFF * 2 ** (failures - 1), MAX_RECONNECT_BACKOFF)
+                print(f"Feed {feed} failed ({e}); reconnecting in {delay:.1f}s", file=sys.stderr)
+                feed_reconnects_total.inc(feed)
+                await asyncio.sleep(delay)
+    finally:
+        pipeline.end_feed(feed)
+
+# Consume several feeds concurrently into one pipeline, so one model and one
+# tick tracker serve every region. Handling a record never awaits, so the
+# feeds' records are merged on the event loop without locks. The watermark
+# follows the slowest feed that is still streaming, so a feed running ahead
+# cannot close ticks another has yet to fill. A feed that fails for good is
+# reported and the others keep streaming.
+async def stream_feeds(urls, pipeline, log=None):
+    feeds = feed_names(urls)
+    for feed in feeds:
+        pipeline.start_feed(feed)
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=FEED_READ_TIMEOUT, sock_read=FEED_READ_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        results = await asyncio.gather(*(consume_feed(session, url, pipeline, log, feed=feed)
+                                         for url, feed in zip(urls, feeds)), return_exceptions=True)
+    pipeline.flush()
+    failed = [(feed, result) for feed, result in zip(feeds, results) if isinstance(result, BaseException)]
+    for feed, error in failed:
+        print(f"Feed {feed} gave up: {error}", file=sys.stderr)
+    if failed and len(failed) == len(urls):
+        raise failed[0][1]
+
+# Single-feed client
+async def stream_data(url, pipeline, log=None):
+    await stream_feeds([url], pipeline, log)
 
 if __name__ == "__main__":
-    url = 'http://localhost:8000'
+    parser = argparse.ArgumentParser(description='Score streamed weather records and publish county risk')
+    parser.add_argument('--url', action='append',
+                        help=f'feed endpoint, optionally with its own counties= or fields=; repeat to consume '
+                             f'several feeds at once, default {DEFAULT_URL}')
+    parser.add_argument('--alert-stdout', action='store_true', help='print alerts to stdout')
+    parser.add_argument('--alert-log', help='append alerts as JSON lines to this file')
+    parser.add_argument('--alert-webhook', help='POST alerts to this URL')
+    parser.add_argument('--alert-hysteresis', type=float, default=alert_engine.hysteresis)
+    parser.add_argument('--alert-min-dwell-hours', type=float, default=0.0)
+    parser.add_argument('--counties', help='comma-separated counties to subscribe to, default all')
+    parser.add_argument('--all-fields', action='store_true',
+                        help='receive every record field even when the ingest log is off')
+    parser.add_argument('--expected-counties', type=int,
+                        help='counties that complete an hourly tick across all feeds, default all subscribed counties')
+    parser.add_argument('--allowed-lateness-hours', type=float, default=0.0,
+                        help='how far the watermark trails the latest event time of the slowest feed')
+    parser.add_argument('--late-policy', choices=['history', 'drop'], default='history',
+                        help='what to do with stale or late records')
+    parser.add_argument('--explain-threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='explain counties whose risk is above this threshold')
+    parser.add_argument('--explain-top', type=int, default=DEFAULT_TOP_FEATURES,
+                        help='contributing features kept per explanation')
+    parser.add_argument('--no-explain', action='store_true', help='disable per-feature explanations')
+    parser.add_argument('--shadow-model', help='candidate model (.json or .pkl) to score alongside the live model')
+    parser.add_argument('--shadow-queue', type=int, default=4,
+                        help='tick batches the shadow model may fall behind before batches are dropped')
+    parser.add_argument('--shadow-report', default=SHADOW_REPORT_FILE, help='divergence report written by the shadow model')
+    parser.add_argument('--ingest-log', default=LOG_DIR, help='directory of the raw record log for replays')
+    parser.add_argument('--no-ingest-log', action='store_true',
+                        help='do not log raw records; the client then only receives the fields it reads')
+    args = parser.parse_args()
     #clear weather data
     # Remove the Parquet file if it exists
-    
-    asyncio.run(stream_data(url, model, features))
+
+    if args.alert_stdout:
+        alert_engine.sinks.append(StdoutSink())
+    if args.alert_log:
+        alert_engine.sinks.append(FileSink(args.alert_log))
+    if args.alert_webhook:
+        alert_engine.sinks.append(WebhookSink(args.alert_webhook))
+    alert_engine.hysteresis = args.alert_hysteresis
+    alert_engine.min_dwell = timedelta(hours=args.alert_min_dwell_hours)
+
+    shadow = None
+    if args.shadow_model:
+        shadow_model = load_model_file(args.shadow_model)
+        shadow = ShadowScorer(shadow_model, shadow_model.feature_names or features,
+                              max_queue=args.shadow_queue, report_file=args.shadow_report)
+
+    counties = args.counties.split(',') if args.counties else None
+    expected_counties = args.expected_counties or (len(counties) if counties else EXPECTED_COUNTIES)
+    # The ingest log keeps whole records, so replays can score models that
+    # read fields this one does not; only an unlogged client narrows the stream
+    fields = None
+    if args.no_ingest_log and not args.all_fields:
+        fields = subscription_fields(features + (shadow.features if shadow else []))
+    urls = [subscription_url(url, fields, counties) for url in args.url or [DEFAULT_URL]]
+
+    metrics.start_metrics_server(METRICS_PORT)
+    start_query_server(risk_index, QUERY_PORT)
+    explainer = None if args.no_explain else Explainer(MODEL_JSON, features, args.explain_threshold,
+                                                       args.explain_top)
+    log = None if args.no_ingest_log else IngestLog(args.ingest_log)
+    try:
+        pipeline = ScoringPipeline(model, features, expected_counties=expected_counties,
+                                   allowed_lateness=timedelta(hours=args.allowed_lateness_hours),
+                                   late_policy=args.late_policy, graph=county_graph, explainer=explainer,
+                                   shadow=shadow)
+        asyncio.run(stream_feeds(urls, pipeline, log))
+    finally:
+        alert_engine.close()
+        if log is not None:
+            log.close()
+        if explainer is not None:
+            explainer.close()
+        if shadow is not None:
+            shadow.close()
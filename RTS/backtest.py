@@ -0,0 +1,277 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import asyncio_refresh
+from alerts import DEFAULT_BANDS, DEFAULT_HYSTERESIS, AlertEngine
+from risk_index import RiskIndex
+
+# Historical backtest of the real-time pipeline. Days of the feature table
+# (ML_Model/feature_table.py) are replayed hour by hour through the same
+# ScoringPipeline and AlertEngine the client runs, so per-county overwrite,
+# tick timing, neighbor features, hysteresis and dwell all behave as they
+# would live, and the alerts are matched against TornadoEvents.csv.
+# Date ranges are independent and run in parallel in a process pool; each
+# range first replays the days before it without counting them, so alert
+# state is warm at the range boundary. Nothing is written per tick.
+
+script_dir = os.path.dirname(__file__)
+DATA_DIR = os.path.join(script_dir, '..', 'ML_Model', 'feature_table')
+EVENTS_FILE = os.path.join(script_dir, '..', 'ML_Model', 'TornadoEvents.csv')
+REPORT_FILE = 'backtest_report.json'
+
+DEFAULT_RANGE_DAYS = 30
+WARMUP_DAYS = 1
+
+# An alert counts for a tornado when it is active from this long before
+# BEGIN_DATETIME until this long after it; the labeling window of the
+# training data in ML_Model/feature_table.py
+MAX_LEAD = timedelta(hours=3)
+MAX_DELAY = timedelta(hours=1)
+
+
+# Tornadoes as (county, BEGIN_DATETIME, EF scale), county names as in the feature table
+def load_events(events_file=EVENTS_FILE):
+    events = []
+    with open(events_file, newline='') as f:
+        for row in csv.DictReader(f):
+            county = row['CZ_NAME_STR'].title().replace(' Co.', '')
+            begin_time = row['BEGIN_TIME'].zfill(4)
+            begin = datetime.strptime(f"{row['BEGIN_DATE']} {begin_time}", '%m/%d/%Y %H%M')
+            events.append((county, begin, row['TOR_F_SCALE'].strip() or 'unknown'))
+    return sorted(events, key=lambda event: event[1])
+
+
+def list_days(data_dir=DATA_DIR):
+    return sorted(os.path.basename(path)[:-len('.parquet')] for path in glob.glob(os.path.join(data_dir, '*.parquet')))
+
+
+# Consecutive runs of up to range_days of the selected days, each with the
+# table days before it for warm-up
+def date_ranges(days, all_days, range_days=DEFAULT_RANGE_DAYS, warmup_days=WARMUP_DAYS):
+    ranges = []
+    for start in range(0, len(days), range_days):
+        selected = days[start:start + range_days]
+        first = all_days.index(selected[0])
+        ranges.append((all_days[max(first - warmup_days, 0):first], selected))
+    return ranges
+
+
+# One day of records in the client's record format, in event-time order.
+# ParquetFile reads without pyarrow.dataset, which would import pandas in
+# every worker
+def read_day(data_dir, day):
+    table = pq.ParquetFile(os.path.join(data_dir, f'{day}.parquet')).read()
+    if not table.schema.field('time').type.equals('string'):
+        table = table.set_column(table.schema.get_field_index('time'), 'time',
+                                 pc.strftime(table['time'], format='%Y-%m-%dT%H:%M:%S'))
+    return table.sort_by('time').to_pylist()
+
+
+class CollectSink:
+    def __init__(self):
+        self.alerts = []
+
+    def emit(self, alert):
+        self.alerts.append(alert)
+
+    def close(self):
+        pass
+
+
+# Alert episodes per county: from an alert into an alerting band until the
+# next alert out of them, or the end of the replay
+def alert_episodes(alerts, alerting_bands, end):
+    episodes = []
+    open_episodes = {}
+    for alert in alerts:
+        county, alert_time = alert['county'], datetime.fromisoformat(alert['time'])
+        episode = open_episodes.get(county)
+        if alert['band'] in alerting_bands:
+            if episode is None:
+                episode = open_episodes[county] = {'county': county, 'start': alert_time, 'end': end,
+                                                   'peak_risk': alert['risk']}
+                episodes.append(episode)
+            episode['peak_risk'] = max(episode['peak_risk'], alert['risk'])
+        elif episode is not None:
+            episode['end'] = alert_time
+            del open_episodes[county]
+    return episodes
+
+
+# Replay one date range in a worker process
+def run_range(data_dir, warmup, days, model, features, expected_counties, alerting_bands, hysteresis, min_dwell):
+    start = time.perf_counter()
+    sink = CollectSink()
+    pipeline = asyncio_refresh.ScoringPipeline(
+        model, features, parquet_file=None, expected_counties=expected_counties, index=RiskIndex(),
+        alerts=AlertEngine([sink], hysteresis=hysteresis, min_dwell=min_dwell),
+        graph=asyncio_refresh.county_graph)
+
+    records = 0
+    county_days = set()
+    for day in warmup + days:
+        day_records = read_day(data_dir, day)
+        for record in day_records:
+            pipeline.handle(record)
+        if day in days:
+            records += len(day_records)
+            county_days.update((record['county_name'], day) for record in day_records)
+    pipeline.flush()
+
+    range_start = datetime.fromisoformat(days[0])
+    range_end = datetime.fromisoformat(days[-1]) + timedelta(days=1)
+    episodes = [episode for episode in alert_episodes(sink.alerts, alerting_bands, range_end)
+                if episode['end'] > range_start]
+    return {'days': days, 'records': records, 'county_days': len(county_days), 'episodes': episodes,
+            'seconds': time.perf_counter() - start}
+
+
+def summarize_leads(leads):
+    if not leads:
+        return {}
+    minutes = np.array(leads) / 60.0
+    return {'lead_minutes_median': float(np.median(minutes)), 'lead_minutes_mean': float(minutes.mean()),
+            'lead_minutes_p10': float(np.percentile(minutes, 10))}
+
+
+# Match alert episodes to tornadoes. A tornado is hit when its county is in
+# an alerting band at any time from MAX_LEAD before BEGIN_DATETIME to
+# MAX_DELAY after; the lead time is measured from the start of that episode.
+# An episode that matches no tornado is a false alert. Episodes that span a
+# range boundary are seen by both ranges and counted by the one they start in.
+def evaluate(results, events, max_lead=MAX_LEAD, max_delay=MAX_DELAY):
+    days = {day for result in results for day in result['days']}
+    episodes = [episode for result in results for episode in result['episodes']
+                if episode['start'].date().isoformat() in result['days']]
+    by_county = {}
+    for result in results:
+        for episode in result['episodes']:
+            by_county.setdefault(episode['county'], []).append(episode)
+
+    scales = {}
+    leads = []
+    matched = set()
+    for county, begin, scale in events:
+        if begin.date().isoformat() not in days:
+            continue
+        stats = scales.setdefault(scale, {'events': 0, 'hits': 0, 'leads': []})
+        stats['events'] += 1
+        overlapping = [episode for episode in by_county.get(county, [])
+                       if episode['start'] <= begin + max_delay and episode['end'] > begin - max_lead]
+        matched.update((county, episode['start']) for episode in overlapping)
+        if overlapping:
+            lead = (begin - min(episode['start'] for episode in overlapping)).total_seconds()
+            stats['hits'] += 1
+            stats['leads'].append(lead)
+            leads.append(lead)
+
+    county_days = sum(result['county_days'] for result in results)
+    false_by_county = {}
+    for episode in episodes:
+        if (episode['county'], episode['start']) not in matched:
+            false_by_county[episode['county']] = false_by_county.get(episode['county'], 0) + 1
+    false_alerts = sum(false_by_county.values())
+    events_total = sum(stats['events'] for stats in scales.values())
+    hits = sum(stats['hits'] for stats in scales.values())
+    return {
+        'days': len(days),
+        'records': sum(result['records'] for result in results),
+        'county_days': county_days,
+        'events': events_total,
+        'hits': hits,
+        'hit_rate': hits / events_total if events_total else None,
+        **summarize_leads(leads),
+        'alerts': len(episodes),
+        'false_alerts': false_alerts,
+        'false_alerts_per_county_day': false_alerts / county_days if county_days else None,
+        'alert_precision': (len(episodes) - false_alerts) / len(episodes) if episodes else None,
+        'by_ef_scale': {scale: {'events': stats['events'], 'hits': stats['hits'],
+                                'hit_rate': stats['hits'] / stats['events'], **summarize_leads(stats['leads'])}
+                        for scale, stats in sorted(scales.items())},
+        'false_alerts_by_county': dict(sorted(false_by_county.items(), key=lambda item: -item[1])),
+    }
+
+
+def backtest(data_dir=DATA_DIR, events_file=EVENTS_FILE, start=None, end=None, model=None, features=None,
+             range_days=DEFAULT_RANGE_DAYS, workers=None, expected_counties=asyncio_refresh.EXPECTED_COUNTIES,
+             alert_band='yellow', hysteresis=DEFAULT_HYSTERESIS, min_dwell=timedelta(0)):
+    model = model or asyncio_refresh.model
+    features = features or asyncio_refresh.features
+    band_names = [name for name, _ in sorted(DEFAULT_BANDS, key=lambda band: band[1], reverse=True)]
+    alerting_bands = band_names[:band_names.index(alert_band) + 1]
+
+    all_days = list_days(data_dir)
+    days = [day for day in all_days if (start is None or day >= start) and (end is None or day <= end)]
+    if not days:
+        raise ValueError(f'No feature table days in {data_dir} between {start} and {end}')
+    ranges = date_ranges(days, all_days, range_days)
+
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+        futures = [pool.submit(run_range, data_dir, warmup, selected, model, features, expected_counties,
+                               alerting_bands, hysteresis, min_dwell)
+                   for warmup, selected in ranges]
+        results = [future.result() for future in futures]
+
+    report = evaluate(results, load_events(events_file))
+    elapsed = time.perf_counter() - started
+    report['runtime'] = {'ranges': len(ranges), 'workers': min(workers, len(ranges)), 'seconds': elapsed,
+                         'records_per_s': report['records'] / elapsed,
+                         'range_seconds_max': max(result['seconds'] for result in results)}
+    report['config'] = {'start': days[0], 'end': days[-1], 'range_days': range_days, 'alert_bands': alerting_bands,
+                        'hysteresis': hysteresis, 'min_dwell_hours': min_dwell.total_seconds() / 3600,
+                        'max_lead_hours': MAX_LEAD.total_seconds() / 3600,
+                        'max_delay_hours': MAX_DELAY.total_seconds() / 3600}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backtest the RTS scoring and alerting pipeline on historical weather')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='feature table directory of day parquet files')
+    parser.add_argument('--events', default=EVENTS_FILE)
+    parser.add_argument('--start', help='first day to replay, YYYY-MM-DD')
+    parser.add_argument('--end', help='last day to replay, YYYY-MM-DD')
+    parser.add_argument('--model', help='model to backtest (.json or .pkl), default the client model')
+    parser.add_argument('--range-days', type=int, default=DEFAULT_RANGE_DAYS, help='days per parallel date range')
+    parser.add_argument('--workers', type=int, help='worker processes, default one per core')
+    parser.add_argument('--expected-counties', type=int, default=asyncio_refresh.EXPECTED_COUNTIES)
+    parser.add_argument('--alert-band', default='yellow', choices=[name for name, _ in DEFAULT_BANDS],
+                        help='least severe band that counts as an alert')
+    parser.add_argument('--alert-hysteresis', type=float, default=DEFAULT_HYSTERESIS)
+    parser.add_argument('--alert-min-dwell-hours', type=float, default=0.0)
+    parser.add_argument('--output', default=REPORT_FILE)
+    args = parser.parse_args()
+
+    model = features = None
+    if args.model:
+        from tree_model import load_model_file
+        model = load_model_file(args.model)
+        features = model.feature_names or asyncio_refresh.features
+    report = backtest(args.data_dir, args.events, args.start, args.end, model, features, args.range_days,
+                      args.workers, args.expected_counties, args.alert_band, args.alert_hysteresis,
+                      timedelta(hours=args.alert_min_dwell_hours))
+
+    tmp_file = f'{args.output}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_file, args.output)
+    runtime = report['runtime']
+    print(f"Replayed {report['records']} records over {report['days']} days in {runtime['seconds']:.1f}s "
+          f"({runtime['records_per_s']:.0f} records/s, {runtime['workers']} workers)")
+    print(f"Hit rate {report['hit_rate']} on {report['events']} tornadoes, "
+          f"median lead {report.get('lead_minutes_median')} min, "
+          f"{report['false_alerts_per_county_day']} false alerts per county-day")
+    for scale, stats in report['by_ef_scale'].items():
+        print(f"  {scale}: {stats['hits']}/{stats['events']} hit")
+    print(f"Report written to {args.output}")
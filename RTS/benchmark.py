@@ -0,0 +1,448 @@
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import timedelta
+
+import numpy as np
+from scipy import sparse
+
+import spatial
+import synthetic_stream
+from risk_index import RiskIndex
+from server import StreamHandler
+
+# End-to-end benchmark suite for the real-time pipeline. Every benchmark runs
+# on synthetic records at each requested scale (a multiple of the 99 demo
+# counties) and results are written as JSON, one file per commit, so two runs
+# can be compared with --baseline.
+
+script_dir = os.path.dirname(__file__)
+RESULTS_DIR = os.path.join(script_dir, 'bench_results')
+DEMO_COUNTIES = 99
+
+# Metrics where a larger value is better; everything else is a cost
+HIGHER_IS_BETTER = ('records_per_s',)
+REGRESSION_TOLERANCE = 0.10
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=script_dir,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    def percentile(p):
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+    return {'mean_s': statistics.fmean(ordered), 'p50_s': percentile(0.50),
+            'p95_s': percentile(0.95), 'p99_s': percentile(0.99), 'n': len(ordered)}
+
+
+def repeat(func, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+# Run the real server handler with no delay on an ephemeral port
+class BenchServer:
+    def __init__(self, records_file, delay=0, start_after=1):
+        self.handler = type('BenchHandler', (StreamHandler,), {'file_name': records_file, 'delay': delay,
+                                                               'start_after': start_after,
+                                                               'log_message': lambda self, *args: None})
+        self.httpd = socketserver.ThreadingTCPServer(('127.0.0.1', 0), self.handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        return False
+
+
+def bench_server_emit(records_file, n_records):
+    with BenchServer(records_file) as server:
+        start = time.perf_counter()
+        received = 0
+        with urllib.request.urlopen(server.url) as response:
+            for line in response:
+                if line.strip():
+                    received += 1
+        elapsed = time.perf_counter() - start
+    return {'records': received, 'elapsed_s': elapsed, 'records_per_s': received / elapsed}
+
+
+# Several subscribers on one feed: everyone takes every field of every
+# record (what the server sent before subscriptions), everyone shares one
+# regional shape, or each has its own region. Regions are 10% of counties
+# and regional subscribers only take the fields the client reads.
+def bench_server_fanout(records_file, n_records, n_counties, subscribers=4):
+    import asyncio_refresh
+
+    counties = sorted({record['county_name'] for record in synthetic_stream.iter_records(n_counties, 1)})
+    region = max(len(counties) // 10, 1)
+    fields = ','.join(asyncio_refresh.subscription_fields(asyncio_refresh.features))
+    scenarios = {
+        'full': [''] * subscribers,
+        'regional_shared': [urllib.parse.urlencode({'counties': ','.join(counties[:region]), 'fields': fields})]
+                           * subscribers,
+        'regional_distinct': [urllib.parse.urlencode({'counties': ','.join(counties[i * region:(i + 1) * region]),
+                                                      'fields': fields}) for i in range(subscribers)],
+    }
+    results = {}
+    for name, queries in scenarios.items():
+        received = [0] * len(queries)
+        def read(i, query):
+            with urllib.request.urlopen(f'{server.url}/?{query}') as response:
+                for line in response:
+                    received[i] += len(line)
+        with BenchServer(records_file, start_after=len(queries)) as server:
+            threads = [threading.Thread(target=read, args=(i, query)) for i, query in enumerate(queries)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            stats = server.handler.feed.stats
+        results[name] = {'elapsed_s': elapsed, 'feed_cpu_s': stats['cpu_s'], 'encodes': stats['encodes'],
+                         'lines': stats['lines'], 'bytes': sum(received)}
+    results['subscribers'] = subscribers
+    results['records'] = n_records
+    return results
+
+
+def bench_client(records_file, n_records, n_counties, workdir):
+    import asyncio_refresh
+
+    parquet_file = os.path.join(workdir, f'client_risk_{n_counties}.parquet')
+    pipeline = asyncio_refresh.ScoringPipeline(asyncio_refresh.model, asyncio_refresh.features, parquet_file,
+                                               expected_counties=n_counties)
+    with BenchServer(records_file) as server:
+        url = asyncio_refresh.subscription_url(server.url, asyncio_refresh.subscription_fields(asyncio_refresh.features))
+        start = time.perf_counter()
+        asyncio.run(asyncio_refresh.stream_data(url, pipeline))
+        elapsed = time.perf_counter() - start
+    return {'records': n_records, 'elapsed_s': elapsed, 'records_per_s': n_records / elapsed}
+
+
+# One client consuming regional feeds from separate servers, merged into
+# one pipeline; the lateness window covers feeds running ahead of each other.
+# Every server scans the whole file in this process, so on few cores the
+# servers' CPU shows up in the elapsed time
+def bench_client_feeds(records_file, n_records, n_counties, workdir, feeds=4):
+    import asyncio_refresh
+
+    with open(records_file) as f:
+        counties = sorted({record['county_name'] for record in json.load(f)})
+    parquet_file = os.path.join(workdir, f'client_feeds_risk_{n_counties}.parquet')
+    pipeline = asyncio_refresh.ScoringPipeline(asyncio_refresh.model, asyncio_refresh.features, parquet_file,
+                                               expected_counties=len(counties), allowed_lateness=timedelta(days=1))
+    fields = asyncio_refresh.subscription_fields(asyncio_refresh.features)
+    servers = [BenchServer(records_file) for _ in range(feeds)]
+    with contextlib.ExitStack() as stack:
+        urls = [asyncio_refresh.subscription_url(stack.enter_context(server).url, fields, counties[i::feeds])
+                for i, server in enumerate(servers)]
+        start = time.perf_counter()
+        asyncio.run(asyncio_refresh.stream_feeds(urls, pipeline))
+        elapsed = time.perf_counter() - start
+    return {'feeds': feeds, 'records': n_records, 'elapsed_s': elapsed, 'records_per_s': n_records / elapsed}
+
+
+# Fresh client process: cold start (imports and model load), CPU per scored
+# record without the network, peak resident memory, and whether scoring
+# pulled in pandas
+CLIENT_PROCESS_SCRIPT = '''
+import json, os, resource, sys, time
+start = time.perf_counter()
+import asyncio_refresh
+cold_start = time.perf_counter() - start
+records_file, n_counties, workdir = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+with open(records_file) as f:
+    records = json.load(f)
+pipeline = asyncio_refresh.ScoringPipeline(asyncio_refresh.model, asyncio_refresh.features,
+                                           os.path.join(workdir, 'process_risk.parquet'),
+                                           expected_counties=n_counties, graph=asyncio_refresh.county_graph)
+cpu = time.process_time()
+for record in records:
+    pipeline.handle(record)
+pipeline.flush()
+cpu = time.process_time() - cpu
+print(json.dumps({'cold_start_s': cold_start, 'cpu_per_record_s': cpu / len(records),
+                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'pandas_loaded': 'pandas' in sys.modules}))
+'''
+
+
+def bench_client_process(records_file, n_counties, workdir, repeats):
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', CLIENT_PROCESS_SCRIPT, records_file, str(n_counties), workdir],
+                                cwd=script_dir, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {'cold_start': summarize([run['cold_start_s'] for run in runs]),
+            'cpu_per_record': summarize([run['cpu_per_record_s'] for run in runs]),
+            'max_rss_mb': statistics.fmean(run['max_rss_mb'] for run in runs),
+            'pandas_loaded': any(run['pandas_loaded'] for run in runs)}
+
+
+# Append cost per record, raw sequential read rate, and replay through a
+# fresh scoring pipeline
+def bench_ingest_log(records_file, n_counties, workdir):
+    import asyncio_refresh
+    from alerts import AlertEngine
+    from ingest_log import IngestLog, LogReader, replay
+
+    with open(records_file) as f:
+        records = json.load(f)
+    lines = [json.dumps(record).encode('utf-8') for record in records]
+    log_dir = tempfile.mkdtemp(dir=workdir)
+    log = IngestLog(log_dir)
+    start = time.perf_counter()
+    for line, record in zip(lines, records):
+        log.append(line, time.time(), record['time'])
+    log.close()
+    append_s = time.perf_counter() - start
+
+    reader = LogReader(log_dir)
+    start = time.perf_counter()
+    read = sum(1 for _ in reader.read())
+    read_s = time.perf_counter() - start
+
+    pipeline = asyncio_refresh.ScoringPipeline(asyncio_refresh.model, asyncio_refresh.features,
+                                               os.path.join(log_dir, 'replay.parquet'), expected_counties=n_counties,
+                                               index=RiskIndex(), alerts=AlertEngine(),
+                                               graph=asyncio_refresh.county_graph)
+    start = time.perf_counter()
+    replayed = replay(reader, pipeline)
+    replay_s = time.perf_counter() - start
+    return {'records': len(lines), 'append_per_record_s': append_s / len(lines),
+            'read_records_per_s': read / read_s, 'replay_records_per_s': replayed / replay_s}
+
+
+def bench_inference(records, n_counties, repeats):
+    import numpy as np
+    import asyncio_refresh
+
+    model = asyncio_refresh.model
+    X = np.array([[record[feature] for feature in asyncio_refresh.features]
+                  for record in records[:n_counties]], dtype=np.float32)
+    single = repeat(lambda: model.predict_proba(X[:1]), repeats)
+    batch = repeat(lambda: model.predict_proba(X), repeats)
+    return {'single_row': single, 'batch': batch, 'batch_rows': len(X)}
+
+
+def bench_snapshot_write(records, n_counties, repeats, workdir):
+    import asyncio_refresh
+
+    snapshot = {record['county_name']: {'time': record['time'], 'county': record['county_name'], 'risk': 0.5,
+                                        'neighborhood_risk': 0.5, 'trace_id': 'bench', 'emit_ts': time.time()}
+                for record in records[:n_counties]}
+    parquet_file = os.path.join(workdir, 'snapshot.parquet')
+    return {'write': repeat(lambda: asyncio_refresh.write_snapshot(snapshot, parquet_file), repeats),
+            'rows': len(snapshot)}
+
+
+# Repeat the dashboard's refresh without Streamlit: read, merge, color, render
+def bench_dashboard_refresh(records, n_counties, repeats, workdir):
+    import folium
+    import geopandas as gpd
+    import pandas as pd
+
+    parquet_file = os.path.join(workdir, 'dashboard.parquet')
+    pd.DataFrame([{'time': record['time'], 'county': record['county_name'], 'risk': (i % 100) / 100,
+                   'trace_id': 'bench', 'emit_ts': time.time()}
+                  for i, record in enumerate(records[:n_counties])]).to_parquet(parquet_file)
+    iowa_geo = gpd.read_file(os.path.join(script_dir, 'Iowa_County_Boundaries.geojson'))
+    iowa_geo['county'] = iowa_geo['CountyName']
+
+    def get_color(risk):
+        if pd.isna(risk):
+            return '#59d4ff'
+        elif risk > 0.85:
+            return '#c72b1d'
+        elif risk > 0.5:
+            return '#fdbf3b'
+        return '#869755'
+
+    def refresh():
+        df = pd.read_parquet(parquet_file)
+        df[['county', 'risk']].sort_values(by='risk', ascending=False).head(10)
+        merged_df = iowa_geo.merge(df, on='county', how='left')
+        merged_df['color'] = merged_df['risk'].apply(get_color)
+        m = folium.Map(location=[41.878, -93.097], zoom_start=7)
+        folium.GeoJson(merged_df[['CountyName', 'risk', 'color', 'geometry']],
+                       style_function=lambda feature: {'fillColor': feature['properties']['color']}).add_to(m)
+        m.get_root().render()
+
+    return {'refresh': repeat(refresh, repeats), 'rows': n_counties}
+
+
+def bench_risk_index(records, n_counties, repeats):
+    index = RiskIndex()
+    counties = [record['county_name'] for record in records[:n_counties]]
+    for i, county in enumerate(counties):
+        index.update(county, records[i]['time'], (i % 100) / 100)
+    counter = itertools.count()
+    def update():
+        i = next(counter)
+        index.update(counties[i % n_counties], records[0]['time'], (i % 97) / 97)
+    return {'update': repeat(update, repeats), 'top10': repeat(lambda: index.top(10), repeats),
+            'above': repeat(lambda: index.above(0.85), repeats),
+            'risk': repeat(lambda: index.risk(counties[:5]), repeats), 'rows': n_counties}
+
+
+# Per-tick spatial work on the demo adjacency tiled once per synthetic copy
+# of the counties, so the graph grows with the scale like the records do
+def bench_spatial(n_counties, repeats):
+    names, adjacency = spatial.load_adjacency()
+    copies = -(-n_counties // len(names))
+    tiled = sparse.kron(sparse.identity(copies, format='csr'), adjacency, format='csr')
+    graph = spatial.CountyGraph([f'{i}' for i in range(tiled.shape[0])], tiled)
+    rng = np.random.default_rng(0)
+    risk = rng.random(len(graph))
+    weather = rng.random((len(graph), len(spatial.NEIGHBOR_FEATURES)))
+    return {'smooth': repeat(lambda: graph.smooth(risk), repeats),
+            'neighbor_features': repeat(lambda: graph.neighbor_features(weather, spatial.NEIGHBOR_FEATURES),
+                                        repeats),
+            'rows': len(graph), 'edges': int(tiled.nnz)}
+
+
+BENCHMARKS = ['server_emit', 'server_fanout', 'client', 'client_feeds', 'client_process', 'ingest_log', 'inference', 'snapshot_write', 'dashboard_refresh', 'risk_index',
+              'spatial']
+
+
+def run(scales, hours, repeats, selected, client_max_records, seed):
+    profile = synthetic_stream.DemoProfile()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in scales:
+            n_counties = DEMO_COUNTIES * scale
+            records_file = os.path.join(workdir, f'records_{scale}.json')
+            n_records = synthetic_stream.write_records(records_file, n_counties, hours, seed=seed, profile=profile)
+            records = synthetic_stream.generate_records(n_counties, 1, seed=seed, profile=profile)
+            entry = {'scale': scale, 'counties': n_counties, 'hours': hours, 'records': n_records}
+
+            if 'server_emit' in selected:
+                entry['server_emit'] = bench_server_emit(records_file, n_records)
+            if 'server_fanout' in selected:
+                entry['server_fanout'] = bench_server_fanout(records_file, n_records, n_counties)
+            if 'client' in selected or 'client_feeds' in selected or 'client_process' in selected:
+                # Cap the stream the client has to drain at large scales
+                client_records = min(n_records, client_max_records)
+                client_file = os.path.join(workdir, f'client_{scale}.json')
+                with open(records_file) as f:
+                    client_slice = json.load(f)[:client_records]
+                with open(client_file, 'w') as f:
+                    json.dump(client_slice, f)
+            if 'client' in selected:
+                entry['client'] = bench_client(client_file, client_records, n_counties, workdir)
+            if 'client_feeds' in selected:
+                entry['client_feeds'] = bench_client_feeds(client_file, client_records, n_counties, workdir)
+            if 'client_process' in selected:
+                entry['client_process'] = bench_client_process(client_file, n_counties, workdir,
+                                                               max(1, repeats // 10))
+            if 'ingest_log' in selected:
+                entry['ingest_log'] = bench_ingest_log(records_file, n_counties, workdir)
+            if 'inference' in selected:
+                entry['inference'] = bench_inference(records, n_counties, repeats)
+            if 'snapshot_write' in selected:
+                entry['snapshot_write'] = bench_snapshot_write(records, n_counties, repeats, workdir)
+            if 'dashboard_refresh' in selected:
+                entry['dashboard_refresh'] = bench_dashboard_refresh(records, n_counties, repeats, workdir)
+            if 'risk_index' in selected:
+                entry['risk_index'] = bench_risk_index(records, n_counties, repeats)
+            if 'spatial' in selected:
+                entry['spatial'] = bench_spatial(n_counties, repeats)
+            results.append(entry)
+            print(f"scale {scale}x ({n_counties} counties) done")
+    return results
+
+
+# Flatten nested results into {"scale/benchmark/metric": value}
+def flatten(results):
+    flat = {}
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(f'{prefix}/{key}', item)
+        elif isinstance(value, (int, float)) and prefix.endswith('_s'):
+            flat[prefix] = value
+    for entry in results:
+        for name in BENCHMARKS:
+            if name in entry:
+                walk(f"{entry['scale']}x/{name}", entry[name])
+    return flat
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = flatten(baseline['results'])
+    new = flatten(current['results'])
+    print(f"Comparing {current['commit']} against {baseline['commit']}")
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        if not old[key]:
+            continue
+        ratio = new[key] / old[key]
+        worse = ratio < 1 - REGRESSION_TOLERANCE if key.endswith(HIGHER_IS_BETTER) else ratio > 1 + REGRESSION_TOLERANCE
+        regressions += worse
+        print(f"{'REGRESSION ' if worse else ''}{key}: {old[key]:.6g} -> {new[key]:.6g} ({ratio:.2f}x)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the RTS pipeline on synthetic load')
+    parser.add_argument('--scales', default='1,10,100', help='comma-separated multiples of the 99 demo counties')
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS))
+    parser.add_argument('--client-max-records', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file, defaults to bench_results/<commit>.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(',')]
+    selected = set(args.benchmarks.split(','))
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'config': vars(args),
+        'results': run(scales, args.hours, args.repeats, selected, args.client_max_records, args.seed),
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline and compare(report, args.baseline):
+        raise SystemExit(1)
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Event-time bookkeeping for the RTS client. Each county gets a dense index
+# into a NumPy array holding the latest event time it has reported, so
+# deciding whether a record is stale is one dict lookup and one array read.
+# Records are grouped into hourly ticks; a tick is complete once every
+# expected county has reported it or the watermark moves past it, and each
+# tick is released exactly once, oldest first. Every source (feed) tracks its
+# own latest event time and the watermark is the slowest source's minus the
+# allowed lateness, so a feed running ahead cannot close ticks that a
+# trailing feed has yet to fill.
+
+ACCEPTED = 'accepted'
+STALE = 'stale'
+# Same event time as the county's latest, e.g. a feed sent again from the top
+DUPLICATE = 'duplicate'
+LATE = 'late'
+
+EPOCH = datetime(1970, 1, 1)
+NO_TIME = np.iinfo(np.int64).min
+
+
+# Event times are naive ISO strings; keep them as integer seconds
+def to_seconds(event_time):
+    if isinstance(event_time, str):
+        event_time = datetime.fromisoformat(event_time)
+    return int((event_time.replace(tzinfo=None) - EPOCH).total_seconds())
+
+
+def from_seconds(seconds):
+    return (EPOCH + timedelta(seconds=int(seconds))).isoformat()
+
+
+class CountyRegistry:
+    def __init__(self, names=()):
+        self.index = {}
+        self.names = []
+        for name in names:
+            self.get(name)
+
+    def get(self, name):
+        county_id = self.index.get(name)
+        if county_id is None:
+            county_id = self.index[name] = len(self.names)
+            self.names.append(name)
+        return county_id
+
+    def __len__(self):
+        return len(self.names)
+
+
+class TickTracker:
+    def __init__(self, expected_counties, allowed_lateness=timedelta(0), registry=None, tick_seconds=3600):
+        self.expected_counties = expected_counties
+        self.allowed_lateness = int(allowed_lateness.total_seconds())
+        self.registry = registry or CountyRegistry()
+        self.tick_seconds = tick_seconds
+        self.latest = np.full(max(expected_counties, 1), NO_TIME, dtype=np.int64)
+        # source -> latest event time it has reported
+        self.sources = {}
+        self.closed_through = NO_TIME
+        # tick start -> list of items, released together when the tick closes
+        self._open = {}
+
+    @property
+    def watermark(self):
+        slowest = min(self.sources.values(), default=NO_TIME)
+        if slowest == NO_TIME:
+            return NO_TIME
+        return slowest - self.allowed_lateness
+
+    # Register a source before it reports, so the watermark waits for it
+    def add_source(self, source):
+        self.sources.setdefault(source, NO_TIME)
+
+    # A source that has ended no longer holds the watermark back; returns the
+    # ticks that closes
+    def remove_source(self, source):
+        self.sources.pop(source, None)
+        return self._close_through(self.watermark - self.tick_seconds)
+
+    def _county_id(self, county):
+        county_id = self.registry.get(county)
+        if county_id >= len(self.latest):
+            grown = np.full(max(2 * len(self.latest), county_id + 1), NO_TIME, dtype=np.int64)
+            grown[:len(self.latest)] = self.latest
+            self.latest = grown
+        return county_id
+
+    # Start a county from an event time already scored, e.g. one restored from
+    # a snapshot, so older records are not taken as its latest
+    def seed(self, county, event_time):
+        county_id = self._county_id(county)
+        self.latest[county_id] = max(self.latest[county_id], to_seconds(event_time))
+
+    # Returns (status, county id, closed ticks) where closed ticks is a list of
+    # (tick start seconds, items) now ready to be scored, oldest first
+    def offer(self, county, event_time, item, source=None):
+        county_id = self._county_id(county)
+        seconds = to_seconds(event_time)
+        tick = seconds - seconds % self.tick_seconds
+        if seconds == self.latest[county_id]:
+            return DUPLICATE, county_id, []
+        if seconds < self.latest[county_id]:
+            return STALE, county_id, []
+        if tick <= self.closed_through:
+            return LATE, county_id, []
+
+        self.latest[county_id] = seconds
+        items = self._open.setdefault(tick, [])
+        items.append(item)
+        if seconds > self.sources.get(source, NO_TIME):
+            self.sources[source] = seconds
+
+        if len(items) >= self.expected_counties:
+            return ACCEPTED, county_id, self._close_through(tick)
+        return ACCEPTED, county_id, self._close_through(self.watermark - self.tick_seconds)
+
+    def _close_through(self, tick):
+        closed = []
+        for open_tick in sorted(self._open):
+            if open_tick > tick:
+                break
+            closed.append((open_tick, self._open.pop(open_tick)))
+            self.closed_through = max(self.closed_through, open_tick)
+        return closed
+
+    # Release every open tick, e.g. when the stream ends
+    def flush(self):
+        return self._close_through(np.iinfo(np.int64).max)
@@ -0,0 +1,164 @@
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+import numpy as np
+
+import metrics
+
+# Per-feature explanations for high-risk counties. After each tick the client
+# hands the scored records to a background worker, which keeps only counties
+# above the threshold and has the booster's native TreeSHAP (pred_contribs)
+# run on them as one batch. Scoring never waits on it. Results are cached
+# per county-hour, so a county is explained at most once per event hour. The
+# latest explanation per county is written atomically for the dashboard
+# tooltip. TreeSHAP runs in a separate process, started on the first
+# explanation, so xgboost and the pandas and scikit-learn it pulls in are
+# never imported by the scoring process.
+
+# Written next to tornado_risk.parquet
+EXPLANATIONS_FILE = 'risk_explanations.json'
+
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_TOP_FEATURES = 3
+# County-hours kept in the cache, about two days of hourly ticks
+CACHE_SIZE = 99 * 48
+
+explain_seconds = metrics.register(metrics.Histogram(
+    'rts_explain_seconds', 'Background explanation time per tick batch', 'stage'))
+explained_total = metrics.register(metrics.Counter(
+    'rts_explained_total', 'County-hours offered for explanation by outcome', 'outcome'))
+
+
+def load_explanations(path=EXPLANATIONS_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+# Short tooltip text, e.g. "wind_shear +1.21, rain +0.40"
+def format_contributions(contributions):
+    return ', '.join(f"{item['feature']} {item['contribution']:+.2f}" for item in contributions)
+
+
+# Booster of the explanation process, loaded once when it starts
+_booster = None
+_iteration_range = None
+
+
+def _load_booster(model_file):
+    global _booster, _iteration_range
+    import xgboost
+
+    _booster = xgboost.Booster(model_file=model_file)
+    # Limited to the rounds predict_proba uses after early stopping
+    best_iteration = _booster.attr('best_iteration')
+    _iteration_range = (0, int(best_iteration) + 1) if best_iteration is not None else (0, 0)
+
+
+# One row per record: a contribution per feature, then the bias term
+def _contributions(X, features):
+    import xgboost
+
+    matrix = xgboost.DMatrix(X, feature_names=features)
+    return _booster.predict(matrix, pred_contribs=True, iteration_range=_iteration_range)
+
+
+class Explainer:
+    def __init__(self, model_file, features, threshold=DEFAULT_THRESHOLD, top_features=DEFAULT_TOP_FEATURES,
+                 output_file=EXPLANATIONS_FILE, max_queue=16, cache_size=CACHE_SIZE):
+        # Spawned rather than forked: the client already runs server threads
+        self.pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_load_booster, initargs=(model_file,))
+        self.features = list(features)
+        self.feature_getter = itemgetter(*features)
+        self.threshold = threshold
+        self.top_features = top_features
+        self.output_file = output_file
+        self.cache_size = cache_size
+        # (county, time) -> top contributions; guarded by the lock
+        self.cache = OrderedDict()
+        self.latest = load_explanations(output_file)
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Called on the scoring thread: O(batch) filtering, then a non-blocking put
+    def submit(self, records, preds):
+        batch = [(record, float(pred)) for record, pred in zip(records, preds) if pred > self.threshold]
+        if not batch:
+            return
+        with self.lock:
+            pending = [(record, pred) for record, pred in batch
+                       if (record['county_name'], record['time']) not in self.cache]
+        if len(pending) < len(batch):
+            explained_total.inc('cached', len(batch) - len(pending))
+        if not pending:
+            return
+        try:
+            self.queue.put_nowait(pending)
+        except queue.Full:
+            explained_total.inc('queue_full', len(pending))
+
+    def get(self, county, time):
+        with self.lock:
+            return self.cache.get((county, time))
+
+    def explain(self, batch):
+        X = np.array([self.feature_getter(record) for record, _ in batch], dtype=np.float32)
+        contribs = self.pool.submit(_contributions, X, self.features).result()
+        top = np.argsort(-contribs[:, :-1], axis=1)[:, :self.top_features]
+
+        results = []
+        for i, (record, pred) in enumerate(batch):
+            contributions = [{'feature': self.features[j], 'value': float(X[i, j]),
+                              'contribution': float(contribs[i, j])} for j in top[i]]
+            results.append((record, pred, contributions))
+        return results
+
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                self.pool.shutdown()
+                return
+            start = time.perf_counter()
+            try:
+                results = self.explain(batch)
+            except Exception as e:
+                print(f"Explanation failed: {e}", file=sys.stderr)
+                continue
+            explain_seconds.observe('shap', time.perf_counter() - start)
+
+            with self.lock:
+                for record, pred, contributions in results:
+                    county, event_time = record['county_name'], record['time']
+                    self.cache[(county, event_time)] = contributions
+                    latest = self.latest.get(county)
+                    if latest is None or latest['time'] <= event_time:
+                        self.latest[county] = {'time': event_time, 'risk': pred, 'contributions': contributions}
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                snapshot = dict(self.latest)
+            explained_total.inc('explained', len(results))
+
+            with explain_seconds.time('persist'):
+                tmp_file = f'{self.output_file}.tmp'
+                with open(tmp_file, 'w') as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_file, self.output_file)
+
+    # Finish queued batches, then stop the worker
+    def close(self, timeout=10.0):
+        self.queue.put(None)
+        self.thread.join(timeout=timeout)
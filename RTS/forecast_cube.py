@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+from event_time import from_seconds, to_seconds
+from spatial import ADJACENCY_FILE, CountyGraph, neighbor_fields
+from tree_model import load_model_file
+
+# Batch scoring of an hourly forecast into a [hour, county] float32 risk cube.
+# The whole horizon is scored in one vectorized predict call and written to a
+# fixed-layout file: a 64-byte header, the county names as JSON, then the cube
+# aligned to 64 bytes. Readers memory-map the file and slice any hour as a
+# view, with no parse step. Models retrained with neighbor features get
+# them per forecast hour from the same county graph the client uses.
+
+script_dir = os.path.dirname(__file__)
+MODEL_PATH = os.path.join(script_dir, 'xgb_model.pkl')
+CUBE_FILE = 'forecast_risk.cube'
+
+MAGIC = b'TOTOCUBE'
+VERSION = 1
+# magic, version, hours, counties, step seconds, start epoch seconds,
+# names offset, names length, data offset
+HEADER = struct.Struct('<8sIIIIqQQQ')
+HEADER_SIZE = 64
+DATA_ALIGNMENT = 64
+
+# Features of models that do not carry their own names
+features = ['temperature_2m', 'relative_humidity_2m', 'rain', 'pressure_msl', 'surface_pressure',
+            'wind_speed_10m', 'wind_speed_100m', 'wind_direction_10m', 'wind_direction_100m',
+            'soil_temperature_0_to_7cm', 'wind_shear']
+
+
+def load_model(model_path=MODEL_PATH):
+    return load_model_file(model_path)
+
+
+def model_features(model):
+    return getattr(model, 'feature_names', None) or features
+
+
+# Neighbor mean/max of each field at every forecast hour, all hours at once
+def add_neighbor_features(df, hour_index, n_hours, graph, fields):
+    positions = graph.positions(df['county_name'])
+    known = positions >= 0
+    values = np.full((len(graph), n_hours, len(fields)), np.nan)
+    values[positions[known], hour_index[known]] = df.loc[known, fields].to_numpy(dtype=np.float64)
+    df = df.copy()
+    for name, result in graph.neighbor_features(values, fields).items():
+        column = np.full(len(df), np.nan)
+        column[known] = result[positions[known], hour_index[known]]
+        df[name] = column
+    return df
+
+
+# Score every county x hour row of a forecast frame in one pass; counties
+# keep location_id order and hours missing from the forecast stay NaN
+def score_forecast(df, model, features=None, step_seconds=3600, graph=None):
+    features = features or model_features(model)
+    times = pd.to_datetime(df['time'])
+    start_time = times.min()
+    hour_index = ((times - start_time) // pd.Timedelta(seconds=step_seconds)).to_numpy(dtype=np.int64)
+    n_hours = int(hour_index.max()) + 1
+
+    counties = df[['location_id', 'county_name']].drop_duplicates('county_name').sort_values('location_id')
+    county_names = counties['county_name'].tolist()
+    county_index = pd.Series(np.arange(len(county_names)), index=county_names)
+    column_index = county_index.loc[df['county_name']].to_numpy()
+
+    fields = neighbor_fields(features)
+    if fields:
+        if graph is None:
+            raise ValueError('The model uses neighbor features; pass the county graph')
+        df = add_neighbor_features(df, hour_index, n_hours, graph, fields)
+
+    preds = model.predict_proba(df[features].to_numpy(dtype=np.float32))[:, 1]
+    cube = np.full((n_hours, len(county_names)), np.nan, dtype=np.float32)
+    cube[hour_index, column_index] = preds
+    return cube, county_names, to_seconds(start_time.to_pydatetime()), step_seconds
+
+
+def write_cube(path, cube, county_names, start, step_seconds):
+    names = json.dumps(county_names).encode('utf-8')
+    names_offset = HEADER_SIZE
+    data_offset = -(-(names_offset + len(names)) // DATA_ALIGNMENT) * DATA_ALIGNMENT
+    header = HEADER.pack(MAGIC, VERSION, cube.shape[0], cube.shape[1], step_seconds, start,
+                         names_offset, len(names), data_offset)
+
+    # Write next to the target and swap it in so readers never see a partial cube
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(names)
+        f.write(b'\0' * (data_offset - names_offset - len(names)))
+        f.write(np.ascontiguousarray(cube, dtype='<f4').tobytes())
+    os.replace(tmp_path, path)
+
+
+class RiskCube:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            (magic, version, n_hours, n_counties, self.step_seconds, self.start,
+             names_offset, names_length, data_offset) = HEADER.unpack(header[:HEADER.size])
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'{path} is not a version {VERSION} risk cube')
+            f.seek(names_offset)
+            self.county_names = json.loads(f.read(names_length))
+        self.county_index = {name: i for i, name in enumerate(self.county_names)}
+        self.cube = np.memmap(path, dtype='<f4', mode='r', offset=data_offset, shape=(n_hours, n_counties))
+
+    @property
+    def n_hours(self):
+        return self.cube.shape[0]
+
+    def hour_time(self, hour):
+        return from_seconds(self.start + hour * self.step_seconds)
+
+    # Risk for every county at one forecast hour, as a view into the mapped file
+    def hour(self, hour):
+        return self.cube[hour]
+
+    def county(self, county):
+        return self.cube[:, self.county_index[county]]
+
+    # Frame in the snapshot layout so the dashboard can render a forecast hour
+    def hour_frame(self, hour):
+        return pd.DataFrame({'time': self.hour_time(hour), 'county': self.county_names,
+                             'risk': np.asarray(self.cube[hour], dtype=np.float64)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Score an hourly forecast file into a memory-mapped risk cube')
+    parser.add_argument('forecast', help='forecast records in the demo_data.json schema')
+    parser.add_argument('--output', default=CUBE_FILE)
+    parser.add_argument('--model', default=MODEL_PATH, help='pickled model or its JSON export')
+    parser.add_argument('--adjacency', default=ADJACENCY_FILE,
+                        help='county adjacency file, read when the model uses neighbor features')
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    graph = CountyGraph.load(args.adjacency) if neighbor_fields(model_features(model)) else None
+    start_time = time.perf_counter()
+    df = pd.read_json(args.forecast, convert_dates=False)
+    loaded = time.perf_counter()
+    cube, county_names, start, step_seconds = score_forecast(df, model, graph=graph)
+    scored = time.perf_counter()
+    write_cube(args.output, cube, county_names, start, step_seconds)
+    written = time.perf_counter()
+
+    print(f"Scored {len(df)} rows into a {cube.shape[0]} hour x {cube.shape[1]} county cube at {args.output}")
+    print(f"load {loaded - start_time:.3f}s, score {scored - loaded:.3f}s, write {written - scored:.3f}s")
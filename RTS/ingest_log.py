@@ -0,0 +1,281 @@
+import argparse
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from event_time import to_seconds
+
+# Durable log of every raw record the RTS client receives, so a feed can be
+# replayed through the scoring pipeline later (incident review, new models).
+# The log is a directory of segments named by their first record offset.
+# Each segment is a header followed by checksummed frames:
+#   length, crc32, offset, arrival time, raw JSON line
+# and has a fixed-width index file of (offset, position, event time) entries.
+# Segments roll over by size or age and are never modified once closed.
+# Replay memory-maps one segment at a time and walks the frames in order.
+
+LOG_DIR = 'ingest_log'
+
+MAGIC = b'TOTOLOG\0'
+VERSION = 1
+# magic, version, reserved
+SEGMENT_HEADER = struct.Struct('<8sII')
+# payload length, crc32 of everything after it, offset, arrival epoch seconds
+FRAME = struct.Struct('<IIQd')
+CHECKED_FIELDS = struct.Struct('<Qd')
+INDEX_ENTRY = struct.Struct('<QQq')
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('position', '<u8'), ('event_time', '<i8')])
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_SEGMENT_SECONDS = 3600
+DEFAULT_FSYNC_SECONDS = 1.0
+
+
+def segment_paths(directory, first_offset):
+    base = os.path.join(directory, f'{first_offset:020d}')
+    return base + '.log', base + '.idx'
+
+
+def list_segments(directory):
+    paths = sorted(glob.glob(os.path.join(directory, '*.log')))
+    return [int(os.path.basename(path)[:-len('.log')]) for path in paths]
+
+
+def frame_crc(offset, arrival, payload):
+    return zlib.crc32(payload, zlib.crc32(CHECKED_FIELDS.pack(offset, arrival)))
+
+
+# Walk the valid frames of a segment buffer from a position; stops at the end
+# or at the first torn or corrupt frame
+def iter_frames(buffer, position=SEGMENT_HEADER.size, verify=True):
+    end = len(buffer)
+    while position + FRAME.size <= end:
+        length, crc, offset, arrival = FRAME.unpack_from(buffer, position)
+        start = position + FRAME.size
+        if start + length > end:
+            return
+        payload = buffer[start:start + length]
+        if verify and crc != frame_crc(offset, arrival, payload):
+            return
+        yield position, offset, arrival, payload
+        position = start + length
+
+
+class IngestLog:
+    def __init__(self, directory=LOG_DIR, max_segment_bytes=DEFAULT_SEGMENT_BYTES,
+                 max_segment_seconds=DEFAULT_SEGMENT_SECONDS, fsync_seconds=DEFAULT_FSYNC_SECONDS):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_seconds = max_segment_seconds
+        self.fsync_seconds = fsync_seconds
+        os.makedirs(directory, exist_ok=True)
+        self.next_offset = self._recover()
+        self.log_file = None
+        self.index_file = None
+        self.last_sync = time.monotonic()
+
+    # Repair the newest segment after a crash: drop a torn index tail, index
+    # frames that were written but not indexed, and truncate a torn frame.
+    # Appends always go to a fresh segment.
+    def _recover(self):
+        segments = list_segments(self.directory)
+        if not segments:
+            return 0
+        log_path, index_path = segment_paths(self.directory, segments[-1])
+        index_size = os.path.getsize(index_path) if os.path.exists(index_path) else 0
+        index_size -= index_size % INDEX_ENTRY.size
+        with open(log_path, 'rb') as f:
+            data = f.read()
+        if len(data) < SEGMENT_HEADER.size:
+            os.remove(log_path)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            return segments[-1]
+
+        with open(index_path, 'ab+') as index:
+            position, next_offset = SEGMENT_HEADER.size, segments[-1]
+            if index_size:
+                index.seek(index_size - INDEX_ENTRY.size)
+                last_offset, last_position, _ = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+                last_frame = next(iter_frames(data, last_position), None)
+                if last_frame is not None and last_frame[1] == last_offset:
+                    position, next_offset = last_position + FRAME.size + len(last_frame[3]), last_offset + 1
+                else:
+                    # The index got ahead of the frames; rebuild it from the start
+                    index_size = 0
+            index.truncate(index_size)
+            index.seek(0, os.SEEK_END)
+            for frame_position, offset, arrival, payload in iter_frames(data, position):
+                record = json.loads(payload)
+                index.write(INDEX_ENTRY.pack(offset, frame_position, to_seconds(record['time'])))
+                position, next_offset = frame_position + FRAME.size + len(payload), offset + 1
+        with open(log_path, 'r+b') as f:
+            f.truncate(position)
+        return next_offset
+
+    def _roll(self):
+        self.close()
+        log_path, index_path = segment_paths(self.directory, self.next_offset)
+        self.log_file = open(log_path, 'wb')
+        self.index_file = open(index_path, 'wb')
+        self.log_file.write(SEGMENT_HEADER.pack(MAGIC, VERSION, 0))
+        self.segment_bytes = SEGMENT_HEADER.size
+        self.segment_started = time.monotonic()
+
+    def append(self, payload, arrival, event_time):
+        if (self.log_file is None or self.segment_bytes >= self.max_segment_bytes or
+                time.monotonic() - self.segment_started >= self.max_segment_seconds):
+            self._roll()
+        offset = self.next_offset
+        position = self.segment_bytes
+        self.log_file.write(FRAME.pack(len(payload), frame_crc(offset, arrival, payload), offset, arrival))
+        self.log_file.write(payload)
+        self.index_file.write(INDEX_ENTRY.pack(offset, position, to_seconds(event_time)))
+        self.segment_bytes += FRAME.size + len(payload)
+        self.next_offset += 1
+
+        # Hand frames to the OS on every append so a client crash loses
+        # nothing; fsync against power loss at most every fsync_seconds
+        self.log_file.flush()
+        self.index_file.flush()
+        if time.monotonic() - self.last_sync >= self.fsync_seconds:
+            self.sync()
+        return offset
+
+    def sync(self):
+        if self.log_file is not None:
+            os.fsync(self.log_file.fileno())
+            os.fsync(self.index_file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.flush()
+            self.index_file.flush()
+            self.sync()
+            self.log_file.close()
+            self.index_file.close()
+            self.log_file = self.index_file = None
+
+
+class LogReader:
+    def __init__(self, directory=LOG_DIR):
+        self.directory = directory
+        self.segments = list_segments(directory)
+
+    def index(self, first_offset):
+        _, index_path = segment_paths(self.directory, first_offset)
+        count = os.path.getsize(index_path) // INDEX_ENTRY.size
+        if count == 0:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.memmap(index_path, dtype=INDEX_DTYPE, mode='r', shape=(count,))
+
+    # Offset of the first record whose event time is at or after event_time,
+    # in log (arrival) order
+    def offset_for_time(self, event_time):
+        seconds = to_seconds(event_time)
+        for first_offset in self.segments:
+            index = self.index(first_offset)
+            hits = np.flatnonzero(index['event_time'] >= seconds)
+            if len(hits):
+                return int(index['offset'][hits[0]])
+        return None
+
+    # (offset, arrival, raw line) for every record from start_offset on
+    def read(self, start_offset=0, verify=True):
+        first = max(bisect.bisect_right(self.segments, start_offset) - 1, 0)
+        for first_offset in self.segments[first:]:
+            position = SEGMENT_HEADER.size
+            if start_offset > first_offset:
+                index = self.index(first_offset)
+                at = np.searchsorted(index['offset'], start_offset)
+                if at == len(index):
+                    continue
+                position = int(index['position'][at])
+            log_path, _ = segment_paths(self.directory, first_offset)
+            if os.path.getsize(log_path) <= SEGMENT_HEADER.size:
+                continue
+            with open(log_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    buffer.madvise(mmap.MADV_SEQUENTIAL)
+                magic, version, _ = SEGMENT_HEADER.unpack_from(buffer, 0)
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError(f'{log_path} is not a version {VERSION} ingest log segment')
+                for _, offset, arrival, payload in iter_frames(buffer, position, verify):
+                    yield offset, arrival, payload
+
+    def info(self):
+        segments = []
+        for first_offset in self.segments:
+            index = self.index(first_offset)
+            log_path, _ = segment_paths(self.directory, first_offset)
+            entry = {'first_offset': first_offset, 'records': len(index), 'bytes': os.path.getsize(log_path)}
+            if len(index):
+                entry['event_time_min'] = int(index['event_time'].min())
+                entry['event_time_max'] = int(index['event_time'].max())
+            segments.append(entry)
+        return segments
+
+
+# Stream logged records through a scoring pipeline as fast as it will go,
+# using the logged arrival times so event-time handling matches the live run
+def replay(reader, pipeline, start_offset=0, limit=None, verify=True):
+    count = 0
+    for offset, arrival, payload in reader.read(start_offset, verify):
+        pipeline.handle(json.loads(payload), arrival)
+        count += 1
+        if limit is not None and count >= limit:
+            break
+    pipeline.flush()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect or replay the RTS ingest log')
+    parser.add_argument('command', choices=['info', 'replay'])
+    parser.add_argument('--log-dir', default=LOG_DIR)
+    parser.add_argument('--from-offset', type=int, default=0)
+    parser.add_argument('--from-time', help='start at the first record with this event time or later')
+    parser.add_argument('--limit', type=int, help='records to replay')
+    parser.add_argument('--model', help='model to replay with (.json or .pkl), default the client model')
+    parser.add_argument('--parquet-file', default='replay_risk.parquet')
+    parser.add_argument('--expected-counties', type=int)
+    parser.add_argument('--no-verify', action='store_true', help='skip checksum verification')
+    args = parser.parse_args()
+
+    reader = LogReader(args.log_dir)
+    if args.command == 'info':
+        print(json.dumps(reader.info(), indent=2))
+    else:
+        import asyncio_refresh
+        from alerts import AlertEngine
+        from risk_index import RiskIndex
+
+        if args.model:
+            from tree_model import load_model_file
+            model = load_model_file(args.model)
+            features = model.feature_names or asyncio_refresh.features
+        else:
+            model, features = asyncio_refresh.model, asyncio_refresh.features
+        start_offset = args.from_offset
+        if args.from_time:
+            start_offset = reader.offset_for_time(args.from_time)
+            if start_offset is None:
+                parser.error(f'no records at or after {args.from_time}')
+        # Replays keep their own index and alert state and never touch the live snapshot
+        pipeline = asyncio_refresh.ScoringPipeline(
+            model, features, args.parquet_file,
+            expected_counties=args.expected_counties or asyncio_refresh.EXPECTED_COUNTIES,
+            index=RiskIndex(), alerts=AlertEngine(), graph=asyncio_refresh.county_graph)
+        start = time.perf_counter()
+        count = replay(reader, pipeline, start_offset, args.limit, not args.no_verify)
+        elapsed = time.perf_counter() - start
+        print(f"Replayed {count} records from offset {start_offset} in {elapsed:.2f}s "
+              f"({count / max(elapsed, 1e-9):.0f} records/s) into {args.parquet_file}")
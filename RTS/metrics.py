@@ -0,0 +1,167 @@
+import bisect
+import http.server
+import threading
+import time
+
+# Lightweight Prometheus-text metrics for the real-time pipeline.
+# Observing a value is one bisect and a few additions under a lock, so the
+# instrumentation is cheap enough to leave on in production.
+
+# Latency buckets in seconds, from sub-millisecond stages up to slow renders
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Context manager used by Histogram.time()
+class _Timer:
+    def __init__(self, histogram, label_value):
+        self.histogram = histogram
+        self.label_value = label_value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(self.label_value, time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        # Prometheus buckets are inclusive upper bounds, which is bisect_left
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, label_value):
+        return _Timer(self, label_value)
+
+    def render(self):
+        with self._lock:
+            snapshot = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_value, (counts, total, count) in sorted(snapshot.items()):
+            label = f'{self.label_name}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_name):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        with self._lock:
+            snapshot = dict(self._values)
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for label_value, value in sorted(snapshot.items()):
+            lines.append(f'{self.name}{{{self.label_name}="{_escape(label_value)}"}} {value}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text, label_name):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, label_value, value):
+        with self._lock:
+            self._values[label_value] = value
+
+    def _current(self, value, now):
+        return value
+
+    def render(self):
+        now = time.time()
+        with self._lock:
+            snapshot = dict(self._values)
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        for label_value, value in sorted(snapshot.items()):
+            lines.append(f'{self.name}{{{self.label_name}="{_escape(label_value)}"}} {self._current(value, now)}')
+        return lines
+
+
+# Gauge that stores a unix timestamp and reports its age at scrape time,
+# so a county that stops updating shows a growing lag without extra work
+class AgeGauge(Gauge):
+    def _current(self, value, now):
+        return max(now - value, 0.0)
+
+
+def register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def render_all():
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_all().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Keep scrapes out of the console
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /metrics from a daemon thread so it never blocks the pipeline
+def start_metrics_server(port, host='127.0.0.1'):
+    httpd = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
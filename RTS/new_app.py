@@ -5,16 +5,42 @@ import folium
 from streamlit_folium import folium_static
 import os
 import time
+import json
+import urllib.request
+
+import metrics
+from explain import EXPLANATIONS_FILE, format_contributions, load_explanations
+from forecast_cube import CUBE_FILE, RiskCube
+
+# Port for the dashboard's Prometheus /metrics endpoint
+METRICS_PORT = 8003
+
+# Top-K endpoint of the RTS client's in-memory risk index
+TOP_RISK_URL = 'http://127.0.0.1:8002/top?k=10'
 
 # Load Iowa county boundaries
 script_dir = os.path.dirname(__file__)
 geojson_path = os.path.join(script_dir, 'Iowa_County_Boundaries.geojson')
 iowa_geo = gpd.read_file(geojson_path)
 
+# Register the dashboard metrics and start /metrics once per process,
+# since Streamlit reruns this script every second
+@st.cache_resource
+def dashboard_metrics():
+    stage_seconds = metrics.register(metrics.Histogram(
+        'rts_dashboard_stage_seconds', 'Time spent in each dashboard stage', 'stage'))
+    end_to_end_seconds = metrics.register(metrics.Histogram(
+        'rts_end_to_end_seconds', 'Time from server emit to the county being rendered on the map', 'stage'))
+    metrics.start_metrics_server(METRICS_PORT)
+    return stage_seconds, end_to_end_seconds
+
+stage_seconds, end_to_end_seconds = dashboard_metrics()
+
 # Function to load data from the Parquet file
 def load_dataframe(parquet_file='tornado_risk.parquet'):
     try:
-        df = pd.read_parquet(parquet_file)
+        with stage_seconds.time('snapshot_read'):
+            df = pd.read_parquet(parquet_file)
         return df
     except FileNotFoundError:
         st.warning('Parquet file not found. Initializing empty DataFrame.')
@@ -23,10 +49,28 @@ def load_dataframe(parquet_file='tornado_risk.parquet'):
         st.error(f'Error loading Parquet file: {e}')
         return pd.DataFrame(columns=['time', 'county', 'risk'])
 
+# Function to map the forecast risk cube; keyed on mtime so a rescored cube is remapped
+@st.cache_resource
+def load_forecast_cube(cube_file, mtime):
+    return RiskCube(cube_file)
+
 # Initialize session state for df_st if it doesn't exist
 if 'df_st' not in st.session_state:
     st.session_state.df_st = load_dataframe()
 
+# Function to get the top 10 counties from the client's risk index,
+# falling back to sorting the snapshot when the client is not running or
+# has not scored anything yet
+def load_top_risks(df):
+    try:
+        with urllib.request.urlopen(TOP_RISK_URL, timeout=0.5) as response:
+            top = json.load(response)
+        if top:
+            return pd.DataFrame(top, columns=['county', 'risk'])
+    except (OSError, ValueError):
+        pass
+    return df[['county', 'risk']].sort_values(by='risk', ascending=False).head(10)
+
 # Function to get the max time for the timestamp
 def get_max_time(df):
     if not df.empty:
@@ -81,21 +125,38 @@ st.markdown(
 )
 st.markdown('</div>', unsafe_allow_html=True)
 
+# Forecast hour selector, shown once forecast_cube.py has written a cube;
+# slicing an hour is a view into the mapped file
+display_df = st.session_state.df_st
+forecast_hour = None
+if os.path.exists(CUBE_FILE):
+    cube = load_forecast_cube(CUBE_FILE, os.path.getmtime(CUBE_FILE))
+    hour_options = ['Live'] + [cube.hour_time(hour) for hour in range(cube.n_hours)]
+    choice = st.select_slider('Forecast hour', options=hour_options, key='forecast_hour')
+    if choice != 'Live':
+        forecast_hour = hour_options.index(choice) - 1
+        display_df = cube.hour_frame(forecast_hour)
+
 # Map and table section
 st.markdown('<div class="content">', unsafe_allow_html=True)
 col1, col2 = st.columns([1, 2])
 
 with col1:
     st.markdown('### County Risk Table')
-    top10_risks = st.session_state.df_st[['county', 'risk']].sort_values(by='risk', ascending=False).head(10)
+    if forecast_hour is None:
+        top10_risks = load_top_risks(display_df)
+    else:
+        top10_risks = display_df[['county', 'risk']].sort_values(by='risk', ascending=False).head(10)
     st.dataframe(top10_risks.style.set_table_styles(
         [{'selector': 'table', 'props': [('font-size', '18px')]}]
     ))
 
 with col2:
+    render_start = time.perf_counter()
+
     # Merge the risk data with the GeoJSON data
     iowa_geo['county'] = iowa_geo['CountyName']  # Ensure the county names match
-    merged_df = iowa_geo.merge(st.session_state.df_st, on='county', how='left')
+    merged_df = iowa_geo.merge(display_df, on='county', how='left')
 
     # Set the color based on risk
     def get_color(risk):
@@ -110,6 +171,25 @@ with col2:
 
     merged_df['color'] = merged_df['risk'].apply(get_color)
     merged_df['risk'] = merged_df['risk'].round(4)
+    tooltip_fields = ['CountyName', 'risk']
+    tooltip_aliases = ['County', 'Tornado Risk']
+    if 'neighborhood_risk' in merged_df.columns:
+        merged_df['neighborhood_risk'] = merged_df['neighborhood_risk'].round(4)
+        tooltip_fields.append('neighborhood_risk')
+        tooltip_aliases.append('Neighborhood Risk')
+
+    # Top contributing features for high-risk counties, when the explanation
+    # is for the hour currently shown
+    if forecast_hour is None:
+        explanations = load_explanations(EXPLANATIONS_FILE)
+        def top_features(row):
+            explanation = explanations.get(row['county'])
+            if explanation is None or explanation['time'] != row['time']:
+                return ''
+            return format_contributions(explanation['contributions'])
+        merged_df['top_features'] = merged_df.apply(top_features, axis=1)
+        tooltip_fields.append('top_features')
+        tooltip_aliases.append('Top Features')
 
     # Center the map on Iowa
     m = folium.Map(location=[41.878, -93.097], zoom_start=7)
@@ -128,7 +208,7 @@ with col2:
         merged_df,
         name='Iowa Tornado Risk',
         style_function=style_function,
-        tooltip=folium.GeoJsonTooltip(fields=['CountyName', 'risk'], aliases=['County', 'Tornado Risk'])
+        tooltip=folium.GeoJsonTooltip(fields=tooltip_fields, aliases=tooltip_aliases)
     ).add_to(m)
 
     # Add a layer control panel
@@ -136,6 +216,17 @@ with col2:
 
     # Display the map
     folium_static(m, width=700, height=500)
+    stage_seconds.observe('render', time.perf_counter() - render_start)
+
+    # Record emit-to-render latency for every record shown for the first time
+    if forecast_hour is None and 'emit_ts' in st.session_state.df_st.columns:
+        rendered_at = time.time()
+        last_rendered = st.session_state.get('last_rendered_emit_ts', 0.0)
+        emit_times = st.session_state.df_st['emit_ts'].dropna()
+        for emit_ts in emit_times[emit_times > last_rendered]:
+            end_to_end_seconds.observe('render', rendered_at - emit_ts)
+        if not emit_times.empty:
+            st.session_state.last_rendered_emit_ts = max(last_rendered, emit_times.max())
 
 st.markdown('</div>', unsafe_allow_html=True)
 
@@ -149,7 +240,7 @@ if st.button('Manual Refresh'):
     st.rerun()
 
 # Timestamp
-max_time = get_max_time(st.session_state.df_st)
+max_time = get_max_time(display_df)
 st.markdown(f'<div style="text-align: right;">Predictions as of {max_time}</div>', unsafe_allow_html=True)
 
 # Sleep for a few seconds to prevent rapid reruns
@@ -0,0 +1,147 @@
+import bisect
+import http.server
+import json
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlparse
+
+# In-memory index of current county risk kept next to the client's scoring
+# loop. A sorted (risk, county) list gives top-K and threshold queries by
+# bisection, and a bounded deque per county keeps recent history, so every
+# query is answered from memory without touching the parquet snapshot.
+
+# Port for the local query API
+QUERY_PORT = 8002
+
+# Hourly records kept per county for history queries (one week)
+HISTORY_LENGTH = 24 * 7
+
+
+class RiskIndex:
+    def __init__(self, history_length=HISTORY_LENGTH):
+        self.history_length = history_length
+        self._current = {}
+        self._ordered = []
+        self._history = {}
+        self._lock = threading.Lock()
+
+    def update(self, county, time, risk):
+        risk = float(risk)
+        with self._lock:
+            previous = self._current.get(county)
+            if previous is not None:
+                del self._ordered[bisect.bisect_left(self._ordered, (previous[0], county))]
+            self._current[county] = (risk, time)
+            bisect.insort(self._ordered, (risk, county))
+            history = self._history.get(county)
+            if history is None:
+                history = self._history[county] = deque(maxlen=self.history_length)
+            # Rescoring the latest hour, e.g. after a restart seeded from the snapshot
+            if history and history[-1][0] == time:
+                history[-1] = (time, risk)
+            else:
+                history.append((time, risk))
+
+    def update_many(self, counties, times, risks):
+        for county, time, risk in zip(counties, times, risks):
+            self.update(county, time, risk)
+
+    # Record a score in a county's history without touching its current risk,
+    # used for late or replayed records that are older than the current value
+    def add_history(self, county, time, risk):
+        with self._lock:
+            history = self._history.get(county)
+            if history is None:
+                history = self._history[county] = deque(maxlen=self.history_length)
+            position = len(history)
+            while position > 0 and history[position - 1][0] > time:
+                position -= 1
+            # A score for an hour already in history replaces it
+            if position > 0 and history[position - 1][0] == time:
+                history[position - 1] = (time, float(risk))
+                return
+            if position == 0 and len(history) == history.maxlen:
+                return
+            if len(history) == history.maxlen:
+                history.popleft()
+                position -= 1
+            history.insert(position, (time, float(risk)))
+
+    def risk(self, counties=None):
+        with self._lock:
+            if counties is None:
+                counties = list(self._current)
+            return {county: {'time': self._current[county][1], 'risk': self._current[county][0]}
+                    for county in counties if county in self._current}
+
+    def top(self, k=10):
+        with self._lock:
+            entries = self._ordered[-k:] if k > 0 else []
+            return [{'county': county, 'time': self._current[county][1], 'risk': risk}
+                    for risk, county in reversed(entries)]
+
+    def above(self, threshold):
+        with self._lock:
+            # Counties strictly above the threshold, matching the dashboard's bands
+            start = bisect.bisect_right(self._ordered, (float(threshold), chr(0x10ffff)))
+            return [{'county': county, 'time': self._current[county][1], 'risk': risk}
+                    for risk, county in reversed(self._ordered[start:])]
+
+    def history(self, county, hours=24):
+        with self._lock:
+            entries = list(self._history.get(county, ()))
+        if not entries:
+            return []
+        # Window is relative to the county's latest event time, not wall clock
+        cutoff = (datetime.fromisoformat(entries[-1][0]) - timedelta(hours=hours)).isoformat()
+        return [{'time': time, 'risk': risk} for time, risk in entries if time > cutoff]
+
+    def __len__(self):
+        return len(self._current)
+
+
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    index = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        try:
+            if url.path == '/risk':
+                counties = params['county'][0].split(',') if 'county' in params else None
+                body = self.index.risk(counties)
+            elif url.path == '/top':
+                body = self.index.top(int(params.get('k', ['10'])[0]))
+            elif url.path == '/above':
+                body = self.index.above(float(params['threshold'][0]))
+            elif url.path == '/history':
+                body = self.index.history(params['county'][0], float(params.get('hours', ['24'])[0]))
+            else:
+                self.send_json(404, {'error': f'unknown path {url.path}'})
+                return
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {'error': f'bad query: {e}'})
+            return
+        self.send_json(200, body)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # Keep queries out of the console
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve the query API from a daemon thread next to the scoring loop
+def start_query_server(index, port=QUERY_PORT, host='127.0.0.1'):
+    handler = type('IndexQueryHandler', (QueryHandler,), {'index': index})
+    httpd = http.server.ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
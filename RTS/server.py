@@ -1,44 +1,255 @@
+import argparse
 import http.server
+import queue
+import select
+import socket
 import socketserver
 import json
+import threading
 import time
 import os
+import urllib.parse
+import uuid
 
 PORT = 8000
 FILE_NAME = 'demo_data.json'
+STREAM_DELAY = .1
 
-class StreamHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        # Get the directory of the current script
-        script_dir = os.path.dirname(__file__)
-        file_path = os.path.join(script_dir, FILE_NAME)
+# Subscribers that fall this many records behind are disconnected so one
+# slow consumer never stalls the shared feed
+SUBSCRIBER_QUEUE = 10000
+# How often subscribers waiting for a pass are checked for closed connections
+PRUNE_SECONDS = 1.0
+
+# What a subscriber receives: an optional county set and field list
+# (the trace ID and emit time are always included)
+class Subscription:
+    def __init__(self, counties=None, fields=None):
+        self.counties = frozenset(counties) if counties else None
+        self.fields = tuple(fields) if fields else None
+
+    @classmethod
+    def from_query(cls, query):
+        params = urllib.parse.parse_qs(query)
+        def values(name):
+            return [v for value in params.get(name, []) for v in value.split(',') if v] or None
+        return cls(values('counties'), values('fields'))
+
+    # Subscribers with the same shape share one encoded line per record
+    @property
+    def shape(self):
+        return (self.counties, self.fields)
+
+    def encode(self, record):
+        if self.fields is not None:
+            record = {name: record[name] for name in self.fields + ('trace_id', 'emit_ts') if name in record}
+        return json.dumps(record).encode('utf-8') + b'\n'
+
+
+class Subscriber:
+    def __init__(self, subscription, connection=None):
+        self.subscription = subscription
+        self.connection = connection
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self.dropped = False
+
+    # Clients send nothing after their request, so a readable socket with no
+    # data means the client has gone; the peek leaves anything else unread
+    def disconnected(self):
+        if self.connection is None:
+            return False
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            return True
+
+    def put(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped = True
+            self.close()
+
+    def close(self):
+        # The end marker must get through even when the queue is full
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                return
+            except queue.Full:
+                self.queue.get_nowait()
+
+
+# One pass over the records file shared by every connected subscriber. Each
+# record is stamped once, encoded once per distinct subscription shape that
+# wants it, and the same bytes are queued for every subscriber of that shape.
+# A pass starts when enough subscribers have connected and ends the stream
+# for everyone when the file is exhausted; the next connection starts a new
+# pass, so a lone client still gets the whole day. Clients that disconnect
+# while waiting are pruned and do not count towards the start. A client that
+# connects during a pass joins it and only receives the rest of the day.
+class Feed:
+    def __init__(self, file_path, delay, start_after=1):
+        self.file_path = file_path
+        self.delay = delay
+        self.start_after = start_after
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.subscribers = []
+        self.thread = None
+        self.streaming = False
+        self.stats = {}
 
-        # Load the JSON data for the full day
+    def subscribe(self, subscription, connection=None):
+        subscriber = Subscriber(subscription, connection)
+        with self.lock:
+            if self.streaming:
+                print("Subscriber joined a pass in progress; it receives only the rest of the day")
+            self.subscribers.append(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.ready.notify_all()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def _groups(self):
+        with self.lock:
+            groups = {}
+            for subscriber in self.subscribers:
+                if not subscriber.dropped:
+                    groups.setdefault(subscriber.subscription.shape, []).append(subscriber)
+            return groups
+
+    # Drop waiting subscribers whose clients have disconnected; closing them
+    # ends their handlers. Called with the lock held.
+    def _prune(self):
+        for subscriber in [s for s in self.subscribers if s.disconnected()]:
+            self.subscribers.remove(subscriber)
+            subscriber.close()
+
+    def _run(self):
         try:
-            with open(file_path, 'r') as f:
-                full_day_data = json.load(f)
-        except FileNotFoundError:
+            self._stream()
+        finally:
+            with self.lock:
+                for subscriber in self.subscribers:
+                    subscriber.close()
+                self.subscribers = []
+                self.thread = None
+                self.streaming = False
+
+    def _stream(self):
+        with open(self.file_path, 'r') as f:
+            records = sorted(json.load(f), key=lambda x: x['time'])
+        with self.lock:
+            while True:
+                self._prune()
+                if len(self.subscribers) >= self.start_after:
+                    break
+                self.ready.wait(PRUNE_SECONDS)
+            self.streaming = True
+
+        stats = {'records': 0, 'encodes': 0, 'lines': 0, 'bytes': 0}
+        cpu_start = time.thread_time()
+        for record in records:
+            groups = self._groups()
+            if not groups:
+                break
+            # Stamp each record with a trace ID and the emit time so the
+            # client can measure end-to-end latency
+            record['trace_id'] = uuid.uuid4().hex
+            record['emit_ts'] = time.time()
+            for subscribers in groups.values():
+                subscription = subscribers[0].subscription
+                if subscription.counties is not None and record.get('county_name') not in subscription.counties:
+                    continue
+                line = subscription.encode(record)
+                stats['encodes'] += 1
+                stats['lines'] += len(subscribers)
+                stats['bytes'] += len(line) * len(subscribers)
+                for subscriber in subscribers:
+                    subscriber.put(line)
+            stats['records'] += 1
+            if self.delay:
+                time.sleep(self.delay)  # Simulate a delay for streaming effect
+        stats['cpu_s'] = time.thread_time() - cpu_start
+        self.stats = stats
+
+
+class StreamHandler(http.server.SimpleHTTPRequestHandler):
+    # Overridable per server so benchmarks can stream other files at full speed
+    file_name = FILE_NAME
+    delay = STREAM_DELAY
+    # Subscribers to wait for before a pass over the file starts
+    start_after = 1
+
+    # One shared feed per handler class
+    @classmethod
+    def get_feed(cls):
+        feed = cls.__dict__.get('feed')
+        if feed is None:
+            # Get the directory of the current script
+            script_dir = os.path.dirname(__file__)
+            feed = cls.feed = Feed(os.path.join(script_dir, cls.file_name), cls.delay, cls.start_after)
+        return feed
+
+    # GET /?counties=Polk,Story&fields=time,county_name,rain subscribes to a
+    # subset of the stream; both parameters are optional. A request made
+    # while a pass is streaming joins it mid-day rather than starting over.
+    def do_GET(self):
+        feed = self.get_feed()
+        if not os.path.exists(feed.file_path):
             self.send_response(404)
             self.end_headers()
             self.wfile.write(b'File not found')
             return
 
-        # Sort the data by time in descending order
-        full_day_data = sorted(full_day_data, key=lambda x: x['time'], reverse=False)
-        
+        subscription = Subscription.from_query(urllib.parse.urlsplit(self.path).query)
+        subscriber = feed.subscribe(subscription, self.connection)
+
         # Send headers
         self.send_response(200)
         self.send_header('Content-type', 'application/json')
         self.end_headers()
 
-        # Stream the data record by record
-        for record in full_day_data:
-            self.wfile.write(json.dumps(record).encode('utf-8'))
-            self.wfile.write(b'\n')
-            self.wfile.flush()
-            time.sleep(.1)  # Simulate a delay for streaming effect
+        # Write whatever is queued in one call; the shared lines are never copied per subscriber
+        try:
+            while True:
+                lines = [subscriber.queue.get()]
+                while lines[-1] is not None:
+                    try:
+                        lines.append(subscriber.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                done = lines[-1] is None
+                self.wfile.write(b''.join(lines[:-1] if done else lines))
+                self.wfile.flush()
+                if done:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            feed.unsubscribe(subscriber)
 
 if __name__ == "__main__":
-    with socketserver.TCPServer(("", PORT), StreamHandler) as httpd:
-        print(f"Serving at port {PORT}")
+    parser = argparse.ArgumentParser(description='Stream weather records to RTS clients')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--file', default=FILE_NAME, help='JSON records file, relative to this directory')
+    parser.add_argument('--delay', type=float, default=STREAM_DELAY, help='seconds between records')
+    parser.add_argument('--wait-for', type=int, default=1, help='subscribers to wait for before streaming')
+    args = parser.parse_args()
+    StreamHandler.file_name = args.file
+    StreamHandler.delay = args.delay
+    StreamHandler.start_after = args.wait_for
+
+    # Subscribers are served concurrently from the shared feed
+    socketserver.ThreadingTCPServer.daemon_threads = True
+    with socketserver.ThreadingTCPServer(("", args.port), StreamHandler) as httpd:
+        print(f"Serving at port {args.port}")
         httpd.serve_forever()
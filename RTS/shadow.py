@@ -0,0 +1,159 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from alerts import CLEAR_BAND, DEFAULT_BANDS
+from event_time import CountyRegistry
+
+# Shadow scoring of a candidate model against live traffic. After each tick
+# the client hands the scored batch to a ShadowScorer, whose worker thread
+# scores it again with the candidate and accumulates divergence statistics
+# per county and per primary risk band. Handing off is one non-blocking put
+# on a bounded queue; when the worker falls behind, whole batches are dropped
+# and counted, so the primary path never waits on the shadow.
+
+# Written next to tornado_risk.parquet
+REPORT_FILE = 'shadow_report.json'
+REPORT_SECONDS = 10.0
+
+ABS_DIFF_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+shadow_batches_total = metrics.register(metrics.Counter(
+    'rts_shadow_batches_total', 'Batches offered to the shadow model by outcome', 'outcome'))
+shadow_abs_diff = metrics.register(metrics.Histogram(
+    'rts_shadow_abs_diff', 'Absolute difference between shadow and primary risk', 'band', ABS_DIFF_BUCKETS))
+shadow_band_changes_total = metrics.register(metrics.Counter(
+    'rts_shadow_band_changes_total', 'Scores the shadow model puts in a different band', 'change'))
+
+
+# Band index per risk: 0 is the most severe band, len(bands) is the clear band
+def band_index(risk, thresholds):
+    risk = np.asarray(risk)
+    return sum((risk <= threshold).astype(np.int64) for threshold in thresholds)
+
+
+class DivergenceStats:
+    FIELDS = ('count', 'sum_abs', 'sum_sq', 'max_abs', 'band_agree')
+
+    def __init__(self, size=0):
+        self.values = {name: np.zeros(size) for name in self.FIELDS}
+
+    def grow(self, size):
+        if size > len(self.values['count']):
+            for name, array in self.values.items():
+                self.values[name] = np.concatenate([array, np.zeros(size - len(array))])
+
+    def add(self, keys, diff, agree):
+        abs_diff = np.abs(diff)
+        np.add.at(self.values['count'], keys, 1)
+        np.add.at(self.values['sum_abs'], keys, abs_diff)
+        np.add.at(self.values['sum_sq'], keys, diff * diff)
+        np.maximum.at(self.values['max_abs'], keys, abs_diff)
+        np.add.at(self.values['band_agree'], keys, agree)
+
+    def summary(self, i):
+        count = self.values['count'][i]
+        if not count:
+            return {'count': 0}
+        return {'count': int(count),
+                'mean_abs_diff': float(self.values['sum_abs'][i] / count),
+                'rmse': float(np.sqrt(self.values['sum_sq'][i] / count)),
+                'max_abs_diff': float(self.values['max_abs'][i]),
+                'band_agreement': float(self.values['band_agree'][i] / count)}
+
+
+class ShadowScorer:
+    def __init__(self, model, features, bands=DEFAULT_BANDS, max_queue=4, report_file=REPORT_FILE,
+                 report_seconds=REPORT_SECONDS):
+        self.model = model
+        self.features = list(features)
+        bands = sorted(bands, key=lambda band: band[1], reverse=True)
+        self.band_names = [name for name, _ in bands] + [CLEAR_BAND]
+        self.thresholds = [threshold for _, threshold in bands]
+        self.report_file = report_file
+        self.report_seconds = report_seconds
+        self.last_report = time.monotonic()
+
+        self.registry = CountyRegistry()
+        self.by_county = DivergenceStats()
+        self.by_band = DivergenceStats(len(self.band_names))
+        # primary band x shadow band counts
+        self.band_matrix = np.zeros((len(self.band_names), len(self.band_names)), dtype=np.int64)
+        self.lock = threading.Lock()
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Called on the scoring thread; never blocks
+    def submit(self, records, preds):
+        try:
+            self.queue.put_nowait((records, np.array(preds, dtype=np.float64)))
+        except queue.Full:
+            shadow_batches_total.inc('dropped')
+
+    def score(self, records, primary):
+        # Features the primary model does not use may be missing; XGBoost
+        # treats NaN as missing
+        X = np.array([[record.get(name, np.nan) for name in self.features] for record in records],
+                     dtype=np.float32)
+        shadow = self.model.predict_proba(X)[:, 1].astype(np.float64)
+        diff = shadow - primary
+        primary_band = band_index(primary, self.thresholds)
+        shadow_band = band_index(shadow, self.thresholds)
+        agree = (primary_band == shadow_band).astype(np.float64)
+
+        counties = np.array([self.registry.get(record['county_name']) for record in records], dtype=np.int64)
+        with self.lock:
+            self.by_county.grow(len(self.registry))
+            self.by_county.add(counties, diff, agree)
+            self.by_band.add(primary_band, diff, agree)
+            np.add.at(self.band_matrix, (primary_band, shadow_band), 1)
+
+        for band, abs_diff in zip(primary_band, np.abs(diff)):
+            shadow_abs_diff.observe(self.band_names[band], abs_diff)
+        for band, other in zip(primary_band[agree == 0], shadow_band[agree == 0]):
+            shadow_band_changes_total.inc(f'{self.band_names[band]}->{self.band_names[other]}')
+
+    def summary(self):
+        with self.lock:
+            return {
+                'by_band': {name: self.by_band.summary(i) for i, name in enumerate(self.band_names)},
+                'by_county': {name: self.by_county.summary(i) for i, name in enumerate(self.registry.names)},
+                'band_matrix': {'bands': self.band_names, 'primary_by_shadow': self.band_matrix.tolist()},
+            }
+
+    def write_report(self):
+        tmp_file = f'{self.report_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+        os.replace(tmp_file, self.report_file)
+        self.last_report = time.monotonic()
+
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            try:
+                self.score(*batch)
+            except Exception as e:
+                print(f"Shadow scoring failed: {e}", file=sys.stderr)
+                shadow_batches_total.inc('failed')
+                continue
+            shadow_batches_total.inc('scored')
+            if self.report_file and time.monotonic() - self.last_report >= self.report_seconds:
+                self.write_report()
+        if self.report_file:
+            self.write_report()
+
+    # Finish queued batches, write the final report and stop the worker
+    def close(self, timeout=10.0):
+        self.queue.put(None)
+        self.thread.join(timeout=timeout)
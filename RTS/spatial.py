@@ -0,0 +1,150 @@
+import argparse
+import os
+
+import numpy as np
+
+# County adjacency graph for spatial risk smoothing. The graph is built once
+# from the county polygons (counties whose boundaries touch, corners
+# included) and stored as a CSR matrix, so every per-tick aggregate is one
+# sparse matrix-vector product or one segmented reduction over the nonzeros:
+# O(edges), which stays negligible even for thousands of counties. Scoring
+# works on the raw CSR arrays, so only building the graph needs scipy.
+
+script_dir = os.path.dirname(__file__)
+GEOJSON_FILE = os.path.join(script_dir, 'Iowa_County_Boundaries.geojson')
+ADJACENCY_FILE = os.path.join(script_dir, 'county_adjacency.npz')
+
+# Weight of a county's own risk in the neighborhood risk channel
+SMOOTHING_ALPHA = 0.6
+
+# Weather fields that get neighbor mean/max features
+NEIGHBOR_FEATURES = ['wind_shear', 'wind_speed_100m', 'pressure_msl', 'rain']
+NEIGHBOR_SUFFIXES = ('_nbr_mean', '_nbr_max')
+
+
+def build_adjacency(geojson_file=GEOJSON_FILE, name_field='CountyName'):
+    import geopandas as gpd
+    from scipy import sparse
+
+    gdf = gpd.read_file(geojson_file)
+    left, right = gdf.sindex.query(gdf.geometry, predicate='intersects')
+    keep = left != right
+    n = len(gdf)
+    adjacency = sparse.csr_matrix((np.ones(int(keep.sum()), dtype=np.float32), (left[keep], right[keep])),
+                                  shape=(n, n))
+    adjacency = ((adjacency + adjacency.T) > 0).astype(np.float32).tocsr()
+    return gdf[name_field].tolist(), adjacency
+
+
+def save_adjacency(path, names, adjacency):
+    np.savez(path, names=np.array(names), indptr=adjacency.indptr, indices=adjacency.indices,
+             shape=np.array(adjacency.shape))
+
+
+def load_adjacency(path=ADJACENCY_FILE):
+    from scipy import sparse
+
+    names, indptr, indices = load_arrays(path)
+    n = len(names)
+    adjacency = sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(n, n))
+    return names, adjacency
+
+
+# Names and CSR index arrays, without building a scipy matrix
+def load_arrays(path=ADJACENCY_FILE):
+    with np.load(path) as data:
+        return data['names'].tolist(), data['indptr'], data['indices']
+
+
+class CountyGraph:
+    # adjacency is anything with CSR indptr/indices, e.g. a scipy csr_matrix
+    def __init__(self, names, adjacency):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.indptr = np.asarray(adjacency.indptr, dtype=np.intp)
+        self.indices = np.asarray(adjacency.indices, dtype=np.intp)
+        self.has_neighbors = np.diff(self.indptr) > 0
+        self._rows = np.flatnonzero(self.has_neighbors)
+        self._starts = self.indptr[:-1][self._rows]
+
+    @classmethod
+    def load(cls, path=ADJACENCY_FILE):
+        names, indptr, indices = load_arrays(path)
+        return cls(names, _CSRIndex(indptr, indices))
+
+    def __len__(self):
+        return len(self.names)
+
+    # Graph positions for county names; counties not in the graph map to -1
+    def positions(self, counties):
+        return np.array([self.index.get(county, -1) for county in counties], dtype=np.int64)
+
+    # One segmented reduction over the CSR nonzeros; with np.add this is the
+    # unit-weight sparse matrix-vector product
+    def _reduce(self, ufunc, values, empty):
+        out = np.full(values.shape, empty)
+        if len(self._rows):
+            out[self._rows] = ufunc.reduceat(values[self.indices], self._starts, axis=0)
+        return out
+
+    # Mean over neighbors that have a value; NaN where none do
+    def neighbor_mean(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        present = ~np.isnan(values)
+        total = self._reduce(np.add, np.where(present, values, 0.0), 0.0)
+        count = self._reduce(np.add, present.astype(np.float64), 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    # Max over neighbors, ignoring missing values
+    def neighbor_max(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            return self._reduce(np.fmax, values, np.nan)
+
+    # Neighborhood risk channel: own risk blended with the neighbors' mean
+    def smooth(self, risk, alpha=SMOOTHING_ALPHA):
+        risk = np.asarray(risk, dtype=np.float64)
+        neighbors = self.neighbor_mean(risk)
+        return np.where(np.isnan(neighbors), risk, alpha * risk + (1 - alpha) * neighbors)
+
+    # Neighbor mean/max columns for a [county, ..., feature] array in graph
+    # order, e.g. one tick or every hour of a day. The feature table builds
+    # its training features with this too, so training and serving match.
+    def neighbor_features(self, matrix, feature_names):
+        means = self.neighbor_mean(matrix)
+        maxes = self.neighbor_max(matrix)
+        columns = {}
+        for j, name in enumerate(feature_names):
+            columns[name + '_nbr_mean'] = means[..., j]
+            columns[name + '_nbr_max'] = maxes[..., j]
+        return columns
+
+
+class _CSRIndex:
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+
+# Base weather fields a model needs neighbor features for, in NEIGHBOR_FEATURES order
+def neighbor_fields(model_features):
+    fields = []
+    for name in NEIGHBOR_FEATURES:
+        if any(name + suffix in model_features for suffix in NEIGHBOR_SUFFIXES):
+            fields.append(name)
+    return fields
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the county adjacency matrix from county polygons')
+    parser.add_argument('--geojson', default=GEOJSON_FILE, help='GeoJSON or shapefile of county polygons')
+    parser.add_argument('--name-field', default='CountyName')
+    parser.add_argument('--output', default=ADJACENCY_FILE)
+    args = parser.parse_args()
+
+    names, adjacency = build_adjacency(args.geojson, args.name_field)
+    save_adjacency(args.output, names, adjacency)
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    print(f"Wrote {len(names)} counties, {adjacency.nnz // 2} adjacent pairs "
+          f"(mean degree {degree.mean():.1f}) to {args.output}")
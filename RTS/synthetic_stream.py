@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Synthesize weather records in the demo_data.json schema at any scale.
+# Every synthetic county follows the hourly profile of one demo county, with
+# day-to-day drift and AR(1) hourly noise sized from the spread across demo
+# counties, so means, daily cycles and cross-county variance match the demo.
+
+script_dir = os.path.dirname(__file__)
+DEMO_FILE = os.path.join(script_dir, 'demo_data.json')
+
+# Continuous fields that get drift and noise; the rest are derived
+NOISY_FIELDS = ['temperature_2m', 'relative_humidity_2m', 'pressure_msl', 'surface_pressure',
+                'wind_speed_10m', 'wind_speed_100m', 'soil_temperature_0_to_7cm']
+DIRECTION_FIELDS = ['wind_direction_10m', 'wind_direction_100m']
+INTEGER_FIELDS = ['relative_humidity_2m', 'wind_direction_10m', 'wind_direction_100m']
+
+# Hour-to-hour persistence of the noise and its share of the cross-county spread
+AR_COEFFICIENT = 0.8
+NOISE_SCALE = 0.3
+DIRECTION_NOISE_DEGREES = 15.0
+
+# Same formula as calculate_wind_shear in ML_Model/ml_projectTOTO.ipynb; the
+# feature table builder imports it from here
+def calculate_wind_shear(speed1, speed2, dir1, dir2):
+    dir1_rad = np.radians(dir1)
+    dir2_rad = np.radians(dir2)
+    shear_u = speed2 * np.sin(dir2_rad) - speed1 * np.sin(dir1_rad)
+    shear_v = speed2 * np.cos(dir2_rad) - speed1 * np.cos(dir1_rad)
+    return np.sqrt(shear_u**2 + shear_v**2)
+
+
+class DemoProfile:
+    def __init__(self, demo_file=DEMO_FILE):
+        with open(demo_file, 'r') as f:
+            records = json.load(f)
+
+        # Index demo counties by location_id and hour of day
+        self.county_names = {}
+        hours = sorted({record['time'] for record in records})
+        hour_index = {t: datetime.fromisoformat(t).hour for t in hours}
+        n_counties = max(record['location_id'] for record in records) + 1
+        fields = NOISY_FIELDS + DIRECTION_FIELDS + ['rain']
+        self.values = {field: np.full((n_counties, 24), np.nan) for field in fields}
+        for record in records:
+            self.county_names[record['location_id']] = record['county_name']
+            for field in fields:
+                self.values[field][record['location_id'], hour_index[record['time']]] = record[field]
+
+        # Fill hours missing from the demo with the county's daily mean
+        for field, table in self.values.items():
+            county_mean = np.nanmean(table, axis=1, keepdims=True)
+            self.values[field] = np.where(np.isnan(table), county_mean, table)
+
+        self.n_counties = n_counties
+        self.spread = {field: float(np.nanmean(np.nanstd(self.values[field], axis=0))) for field in NOISY_FIELDS}
+        self.bounds = {field: (float(np.min(table)), float(np.max(table))) for field, table in self.values.items()}
+        rain = self.values['rain']
+        self.rain_probability = float(np.mean(rain > 0))
+        self.rain_amounts = rain[rain > 0] if np.any(rain > 0) else np.array([0.01])
+
+    def county_name(self, county_id):
+        name = self.county_names[county_id % self.n_counties]
+        copy = county_id // self.n_counties
+        return name if copy == 0 else f'{name} {copy + 1}'
+
+
+# Yield records hour by hour, all counties per hour, in event-time order
+def iter_records(n_counties=99, hours=24, start='2024-05-21T00:00:00', seed=0, profile=None):
+    profile = profile or DemoProfile()
+    rng = np.random.default_rng(seed)
+    start_time = datetime.fromisoformat(start)
+    templates = np.arange(n_counties) % profile.n_counties
+    names = [profile.county_name(county_id) for county_id in range(n_counties)]
+
+    # Static per-county offsets keep synthetic copies of a county distinct
+    offsets = {field: rng.normal(0, NOISE_SCALE * profile.spread[field], n_counties) for field in NOISY_FIELDS}
+    drift = {field: np.zeros(n_counties) for field in NOISY_FIELDS}
+    noise = {field: np.zeros(n_counties) for field in NOISY_FIELDS}
+
+    for hour in range(hours):
+        event_time = start_time + timedelta(hours=hour)
+        hour_of_day = event_time.hour
+        if hour_of_day == 0 and hour > 0:
+            for field in NOISY_FIELDS:
+                drift[field] += rng.normal(0, NOISE_SCALE * profile.spread[field], n_counties)
+
+        columns = {}
+        for field in NOISY_FIELDS:
+            noise[field] = (AR_COEFFICIENT * noise[field]
+                            + rng.normal(0, NOISE_SCALE * profile.spread[field], n_counties))
+            value = profile.values[field][templates, hour_of_day] + offsets[field] + drift[field] + noise[field]
+            low, high = profile.bounds[field]
+            margin = 0.1 * (high - low)
+            columns[field] = np.clip(value, low - margin, high + margin)
+        columns['relative_humidity_2m'] = np.clip(columns['relative_humidity_2m'], 0, 100)
+        columns['wind_speed_10m'] = np.maximum(columns['wind_speed_10m'], 0)
+        columns['wind_speed_100m'] = np.maximum(columns['wind_speed_100m'], 0)
+        for field in DIRECTION_FIELDS:
+            value = profile.values[field][templates, hour_of_day] + rng.normal(0, DIRECTION_NOISE_DEGREES, n_counties)
+            columns[field] = np.mod(value, 360)
+
+        # Rain is zero-inflated: keep the template's wet hours, occasionally add new ones
+        template_rain = profile.values['rain'][templates, hour_of_day]
+        new_rain = rng.random(n_counties) < profile.rain_probability * NOISE_SCALE
+        sampled = rng.choice(profile.rain_amounts, n_counties)
+        columns['rain'] = np.where(template_rain > 0, template_rain * rng.lognormal(0, 0.5, n_counties),
+                                   np.where(new_rain, sampled, 0.0))
+
+        for field in INTEGER_FIELDS:
+            columns[field] = np.rint(columns[field]).astype(int)
+        for field in DIRECTION_FIELDS:
+            columns[field] %= 360
+        columns['wind_shear'] = calculate_wind_shear(columns['wind_speed_10m'], columns['wind_speed_100m'],
+                                                     columns['wind_direction_10m'], columns['wind_direction_100m'])
+
+        time_str = event_time.isoformat()
+        for county_id in range(n_counties):
+            yield {
+                'location_id': county_id,
+                'time': time_str,
+                'temperature_2m': round(float(columns['temperature_2m'][county_id]), 1),
+                'relative_humidity_2m': int(columns['relative_humidity_2m'][county_id]),
+                'rain': round(float(columns['rain'][county_id]), 3),
+                'pressure_msl': round(float(columns['pressure_msl'][county_id]), 1),
+                'surface_pressure': round(float(columns['surface_pressure'][county_id]), 1),
+                'wind_speed_10m': round(float(columns['wind_speed_10m'][county_id]), 1),
+                'wind_speed_100m': round(float(columns['wind_speed_100m'][county_id]), 1),
+                'wind_direction_10m': int(columns['wind_direction_10m'][county_id]),
+                'wind_direction_100m': int(columns['wind_direction_100m'][county_id]),
+                'soil_temperature_0_to_7cm': round(float(columns['soil_temperature_0_to_7cm'][county_id]), 1),
+                'county_name': names[county_id],
+                'wind_shear': float(columns['wind_shear'][county_id]),
+            }
+
+
+def generate_records(n_counties=99, hours=24, start='2024-05-21T00:00:00', seed=0, profile=None):
+    return list(iter_records(n_counties, hours, start, seed, profile))
+
+
+# Stream records to a JSON array file the server can read with --file
+def write_records(path, n_counties=99, hours=24, start='2024-05-21T00:00:00', seed=0, profile=None):
+    count = 0
+    with open(path, 'w') as f:
+        f.write('[')
+        for record in iter_records(n_counties, hours, start, seed, profile):
+            if count:
+                f.write(',')
+            f.write(json.dumps(record))
+            count += 1
+        f.write(']')
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate synthetic weather records seeded from demo_data.json')
+    parser.add_argument('output', help='path of the JSON records file to write')
+    parser.add_argument('--counties', type=int, default=99)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--start', default='2024-05-21T00:00:00')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    count = write_records(args.output, args.counties, args.hours, args.start, args.seed)
+    print(f"Wrote {count} records for {args.counties} counties over {args.hours} hours to {args.output}")
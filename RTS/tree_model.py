@@ -0,0 +1,172 @@
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+# Dependency-free scorer for the client's XGBoost model. The booster is
+# exported once to XGBoost's JSON model format and compiled into flat node
+# arrays, so scoring a tick needs only NumPy: no xgboost, scikit-learn or
+# pandas import at startup. All trees are walked together, one level per
+# step, which makes a batch cost max_depth vectorized gathers. Splits follow
+# XGBoost: float32 `value < threshold` goes left, and missing values take the
+# default direction.
+
+script_dir = os.path.dirname(__file__)
+MODEL_PICKLE = os.path.join(script_dir, 'xgb_model.pkl')
+MODEL_JSON = os.path.join(script_dir, 'xgb_model.json')
+
+
+# The export records this hash of the pickle it came from, so a stale export
+# is recognized by content rather than by file times, which a checkout resets
+SOURCE_HASH_ATTR = 'source_sha256'
+
+
+def file_hash(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+# Write the pickled model's booster as JSON; this is the only step that
+# imports xgboost
+def export_json(pickle_file=MODEL_PICKLE, json_file=MODEL_JSON):
+    import pickle
+
+    with open(pickle_file, 'rb') as file:
+        data = file.read()
+    booster = pickle.loads(data).get_booster().copy()
+    booster.set_attr(**{SOURCE_HASH_ATTR: hashlib.sha256(data).hexdigest()})
+    tmp_file = f'{json_file}.tmp.json'
+    booster.save_model(tmp_file)
+    os.replace(tmp_file, json_file)
+    return json_file
+
+
+class TreeEnsemble:
+    def __init__(self, learner):
+        objective = learner['objective']['name']
+        if objective != 'binary:logistic':
+            raise ValueError(f'Unsupported objective {objective}')
+        booster = learner['gradient_booster']
+        if booster['name'] != 'gbtree':
+            raise ValueError(f"Unsupported booster {booster['name']}")
+
+        self.feature_names = learner.get('feature_names') or None
+        base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+        self.base_margin = math.log(base_score / (1 - base_score))
+
+        # Same rounds as XGBClassifier.predict_proba after early stopping
+        trees = booster['model']['trees']
+        best_iteration = learner.get('attributes', {}).get('best_iteration')
+        if best_iteration is not None:
+            per_round = int(booster['model']['gbtree_model_param']['num_parallel_tree'])
+            trees = trees[:(int(best_iteration) + 1) * per_round]
+        self._compile(trees)
+
+    @classmethod
+    def load(cls, json_file=MODEL_JSON):
+        with open(json_file) as f:
+            return cls(json.load(f)['learner'])
+
+    @staticmethod
+    def source_hash(learner):
+        return learner.get('attributes', {}).get(SOURCE_HASH_ATTR)
+
+    # Concatenate all trees into flat arrays. Nodes are renumbered so every
+    # right child directly follows its left child, which turns a step into
+    # `left + goes_right`; leaves point to themselves so extra steps keep them
+    def _compile(self, trees):
+        features, thresholds, lefts, default_right, values, roots = [], [], [], [], [], []
+        offset = 0
+        self.max_depth = 0
+        for tree in trees:
+            if any(tree['split_type']):
+                raise ValueError('Categorical splits are not supported')
+            left, right = tree['left_children'], tree['right_children']
+            order, depth = self._sibling_order(left, right)
+            position = {node: offset + i for i, node in enumerate(order)}
+            for node in order:
+                leaf = left[node] == -1
+                lefts.append(position[node] if leaf else position[left[node]])
+                features.append(0 if leaf else tree['split_indices'][node])
+                thresholds.append(np.inf if leaf else tree['split_conditions'][node])
+                default_right.append(not leaf and not tree['default_left'][node])
+                values.append(tree['split_conditions'][node] if leaf else 0.0)
+            roots.append(offset)
+            self.max_depth = max(self.max_depth, depth)
+            offset += len(order)
+
+        self.features = np.asarray(features, dtype=np.intp)
+        self.thresholds = np.asarray(thresholds, dtype=np.float32)
+        self.lefts = np.asarray(lefts, dtype=np.intp)
+        self.default_right = np.asarray(default_right, dtype=bool)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.roots = np.asarray(roots, dtype=np.intp)
+
+    # Breadth-first node order with each pair of children adjacent
+    @staticmethod
+    def _sibling_order(left, right):
+        order = [0]
+        level = [0]
+        depth = 0
+        while True:
+            level = [child for node in level if left[node] != -1 for child in (left[node], right[node])]
+            if not level:
+                return order, depth
+            order.extend(level)
+            depth += 1
+
+    def margin(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        row_start = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        missing = np.isnan(flat).any()
+        node = np.broadcast_to(self.roots, (n_rows, len(self.roots)))
+        for _ in range(self.max_depth):
+            value = flat[row_start + self.features[node]]
+            # NaN compares False, so missing values only go right by default
+            goes_right = value >= self.thresholds[node]
+            if missing:
+                goes_right |= np.isnan(value) & self.default_right[node]
+            node = self.lefts[node] + goes_right
+        return self.values[node].sum(axis=1, dtype=np.float32) + np.float32(self.base_margin)
+
+    def predict(self, X):
+        return 1.0 / (1.0 + np.exp(-self.margin(X)))
+
+    # Same shape as the scikit-learn wrapper, so either model can be scored
+    def predict_proba(self, X):
+        positive = self.predict(X)
+        return np.column_stack((1.0 - positive, positive))
+
+
+# Compile the client model from its JSON export. The export is only redone,
+# importing xgboost, when it is missing or was made from a different pickle.
+def load_model(pickle_file=MODEL_PICKLE, json_file=MODEL_JSON):
+    if os.path.exists(json_file):
+        with open(json_file) as f:
+            learner = json.load(f)['learner']
+        if not os.path.exists(pickle_file) or TreeEnsemble.source_hash(learner) == file_hash(pickle_file):
+            return TreeEnsemble(learner)
+    export_json(pickle_file, json_file)
+    return TreeEnsemble.load(json_file)
+
+
+# Compile any model file: an XGBoost JSON export, or a pickled model, which
+# gets its JSON export written beside it
+def load_model_file(path):
+    if path.endswith('.json'):
+        return TreeEnsemble.load(path)
+    return load_model(path, os.path.splitext(path)[0] + '.json')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export a pickled XGBoost model to the JSON the client scores with')
+    parser.add_argument('--model', default=MODEL_PICKLE)
+    parser.add_argument('--output', help='JSON export, default the model path with a .json suffix')
+    args = parser.parse_args()
+    print(export_json(args.model, args.output or os.path.splitext(args.model)[0] + '.json'))